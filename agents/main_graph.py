@@ -2,9 +2,13 @@ from langgraph.graph import MessagesState
 from langgraph.graph import END, StateGraph, START
 from langgraph.prebuilt import ToolNode
 from langgraph.prebuilt import tools_condition
-from langchain.tools import tool
 from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import StructuredTool
 from agents.sub_graph import ChatAgent, AgenticRAG, EssayWriter
+from utils import config as settings
+from utils.history import ConversationMemory, count_tokens
+from utils.metrics import metrics
 
 from pydantic import BaseModel
 class ToolInput(BaseModel):
@@ -13,39 +17,67 @@ class ToolInput(BaseModel):
 
 class Supervisor:
     def __init__(self, llm, tools, memory, config, system=""):
-        print("---COMPILING MAIN GRAPH---")
+        metrics.event("compiling_main_graph")
 
         chat_agent = ChatAgent(llm, memory).graph
         rag_agent = AgenticRAG(llm, tools).graph
         essay_writer_agent = EssayWriter(llm, rag_agent).graph
 
-        @tool(args_schema=ToolInput)
-        def chat(query: str) -> str:
-            """Answer on general user query. If you call this tool do NOT change user query, pass the whole query."""
-            print(query)
-            response = chat_agent.invoke({"messages": [query]}, config)
+        def session_config(run_config: RunnableConfig) -> dict:
+            # The chat agent keeps its history under the thread of the calling session
+            thread_id = run_config.get("configurable", {}).get("thread_id") or config["configurable"]["thread_id"]
+            return {"configurable": {"thread_id": thread_id}}
+
+        def chat_(query: str, run_config: RunnableConfig) -> str:
+            metrics.event("tool_call", tool="chat", query=query)
+            response = chat_agent.invoke({"messages": [query]}, session_config(run_config))
             return response['messages'][-1].content
 
-        @tool(args_schema=ToolInput)
-        def research_assistant(query: str) -> str:
-            """
-            A research assistant tool that searches for information in a database and the internet.
-            If you call this tool do NOT change user query, pass the whole query.
-            """
+        async def achat(query: str, run_config: RunnableConfig) -> str:
+            metrics.event("tool_call", tool="chat", query=query)
+            response = await chat_agent.ainvoke({"messages": [query]}, session_config(run_config))
+            return response['messages'][-1].content
+
+        def research_assistant_(query: str) -> str:
             # Performs websearch and search information in vectorstore from research papers on neural network architectures, large language models, and new developments in this area.
-            print(query)
+            metrics.event("tool_call", tool="research_assistant", query=query)
             response = rag_agent.invoke({"messages": [query]})
             return response['messages'][-1].content
 
-        @tool(args_schema=ToolInput)
-        def essay_writer(query: str) -> str:
-            """This tool writes a detailed answer to a question or essay on a user-defined topic"""
-            print(query)
+        async def aresearch_assistant(query: str) -> str:
+            metrics.event("tool_call", tool="research_assistant", query=query)
+            response = await rag_agent.ainvoke({"messages": [query]})
+            return response['messages'][-1].content
+
+        def essay_writer_(query: str) -> str:
+            metrics.event("tool_call", tool="essay_writer", query=query)
             response = essay_writer_agent.invoke({"task": query})
             return response["draft"]
 
+        async def aessay_writer(query: str) -> str:
+            metrics.event("tool_call", tool="essay_writer", query=query)
+            response = await essay_writer_agent.ainvoke({"task": query})
+            return response["draft"]
+
+        chat = StructuredTool.from_function(
+            func=chat_, coroutine=achat, name="chat", args_schema=ToolInput,
+            description="Answer on general user query. If you call this tool do NOT change user query, pass the whole query.")
+        research_assistant = StructuredTool.from_function(
+            func=research_assistant_, coroutine=aresearch_assistant, name="research_assistant", args_schema=ToolInput,
+            description="""
+            A research assistant tool that searches for information in a database and the internet.
+            If you call this tool do NOT change user query, pass the whole query.
+            """)
+        essay_writer = StructuredTool.from_function(
+            func=essay_writer_, coroutine=aessay_writer, name="essay_writer", args_schema=ToolInput,
+            description="This tool writes a detailed answer to a question or essay on a user-defined topic")
+
         self.llm = llm
         self.system=system
+        self.history = ConversationMemory(llm,
+                                          settings.memory_token_budget,
+                                          settings.memory_window_turns,
+                                          settings.memory_tool_payload_chars)
         self.tools = [chat, research_assistant, essay_writer]
 
         builder = StateGraph(MessagesState)
@@ -63,36 +95,24 @@ class Supervisor:
         builder.add_edge("tools", END)
         self.graph = builder.compile(checkpointer=memory)
 
-    def agent(self, state: MessagesState):
+    def agent(self, state: MessagesState, config: RunnableConfig):
         """
         Invokes the agent model to generate a response based on the current state. Given
         the question, it will decide to retrieve using the retriever tool, or simply end.
 
         Args:
             state (messages): The current state
+            config (RunnableConfig): The run config, its thread id selects the cached history summary
 
         Returns:
             dict: The updated state with the agent response appended to messages
         """
-        print("---CALL SUPERVISOR---")
-        messages = state["messages"]
+        messages = self.history.prepare(state["messages"], config["configurable"].get("thread_id", ""))
         if self.system:
             messages = [SystemMessage(content=self.system)] + messages
+        metrics.inc("prompt_tokens_estimated_total", count_tokens(messages), agent="supervisor")
+        metrics.event("prompt", agent="supervisor", tokens=count_tokens(messages))
         model = self.llm.bind_tools(self.tools, tool_choice="auto")
         response = model.invoke(messages)
-        print(response)
+        metrics.event("supervisor_decision", tools=[call["name"] for call in response.tool_calls])
         return {"messages": [response]}
-
-    def refresh(self, llm, tools, memory, config, system=""):
-        self.__init__(llm, tools, memory, config, system)
-
-
-
-
-
-
-
-
-
-
-
@@ -1,8 +1,11 @@
 from typing import TypedDict, List, Literal
+import time
+from langchain_core.documents import Document
 from pydantic import BaseModel, Field
 from langgraph.graph import MessagesState, StateGraph, END, START
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.types import Command
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.messages import (SystemMessage,
                                      HumanMessage,
                                      AIMessage,
@@ -17,6 +20,12 @@ from utils.prompts import (PLAN_PROMPT,
                            RAG_PROMPT)
 
 from utils import config
+from utils.history import ConversationMemory, count_tokens
+from utils.streaming import STREAM_ANSWER
+from utils.llm_cache import uncached
+from utils.context import pack_context
+from utils.runtime import runtime_option
+from utils.metrics import metrics
 
 class DocGradeScore(BaseModel):
     """Binary score that expresses the relevance of the document to the user's question"""
@@ -33,18 +42,22 @@ class RagState(MessagesState):
     question: str
     context: str
     last_tool: str
+    documents: List[Document]
 
 class AgenticRAG:
     def __init__(self, llm, tools, memory=None, system=""):
         self.llm = llm
+        self.stream_llm = uncached(llm)
         self.system = system
         self.tools = tools
+        self.grader = llm.with_structured_output(DocGradeScore, method="json_schema")
+        self.chunk_grader = RunnableLambda(self.grade_chunk, afunc=self.agrade_chunk)
 
         builder = StateGraph(RagState)
         builder.add_node("agent", self.agent)
         builder.add_node("tools", ToolNode(tools))
         builder.add_node("generate", self.generate_answer)
-        builder.add_node("grader", self.grade_documents)
+        builder.add_node("grader", RunnableLambda(self.grade_documents, afunc=self.agrade_documents))
         builder.add_node("tool_condition", self.edge_condition)
         builder.add_node("hallucinations", self.check_hallucinations)
 
@@ -70,7 +83,6 @@ class AgenticRAG:
         Returns:
             dict: The updated state with the agent response appended to messages
         """
-        print("---CALL RAG AGENT---")
         messages = state["messages"]
         question = messages[0].content
         if self.system:
@@ -79,38 +91,81 @@ class AgenticRAG:
         response = model.invoke(messages)
         return {"messages": [response], "question": question}
 
+    def prefilter(self, documents: list[Document]) -> list[Document]:
+        """
+        Drops chunks with a low reranker score and keeps at most `config.grade_max_chunks` of the best
+        reranked or fused chunks for LLM grading.
+        """
+        if documents and all("relevance_score" in doc.metadata for doc in documents):
+            documents = [doc for doc in documents if doc.metadata["relevance_score"] >= config.grade_min_rerank_score]
+            documents = sorted(documents, key=lambda doc: doc.metadata["relevance_score"], reverse=True)
+        elif documents and all("fusion_score" in doc.metadata for doc in documents):
+            documents = sorted(documents, key=lambda doc: doc.metadata["fusion_score"], reverse=True)
+        return documents[:config.grade_max_chunks]
+
+    def grade_chunk(self, inputs: dict) -> bool:
+        start = time.perf_counter()
+        prompt = DOC_GRADER_PROMPT.format(context=inputs["doc"].page_content, question=inputs["question"])
+        score = self.grader.invoke(prompt).binary_score
+        self.record_grade(inputs["doc"], time.perf_counter() - start, score)
+        return score == "yes"
+
+    async def agrade_chunk(self, inputs: dict) -> bool:
+        start = time.perf_counter()
+        prompt = DOC_GRADER_PROMPT.format(context=inputs["doc"].page_content, question=inputs["question"])
+        score = (await self.grader.ainvoke(prompt)).binary_score
+        self.record_grade(inputs["doc"], time.perf_counter() - start, score)
+        return score == "yes"
+
+    @staticmethod
+    def record_grade(doc: Document, seconds: float, score: str):
+        doc.metadata["grade_ms"] = 1000 * seconds
+        metrics.observe("grade_chunk_seconds", seconds)
+        metrics.inc("graded_chunks_total", relevant=score == "yes")
+
+    def route_graded(self, question: str, candidates: list[Document], grades: list[bool]) -> Command:
+        relevant = [doc for doc, grade in zip(candidates, grades) if grade]
+        metrics.event("graded", chunks=len(candidates), relevant=len(relevant),
+                      grade_ms=[round(doc.metadata["grade_ms"]) for doc in candidates])
+
+        if len(relevant) >= config.grade_min_relevant:
+            metrics.event("decision", route="generate")
+            docs = "\n\n".join(doc.page_content for doc in relevant)
+            return Command(goto="generate", update={"messages": docs, "documents": relevant})
+
+        else:
+            metrics.inc("rag_fallback_total", reason="grader_no")
+            metrics.event("decision", route="web_search", reason="grader_no")
+            msg = AIMessage(content="", tool_calls=[
+                            {'name': 'web_search_tool', 'args': {'query': question},
+                            'id': '41d01da6-534d-4aae-824c-b4014ec87e10', 'type': 'tool_call'}])
+
+            return Command(goto="tools", update={"messages": msg, "documents": []})
+
     def grade_documents(self, state: RagState) -> Command[Literal["generate", "tools"]]:
         """
-        Determines whether the retrieved documents are relevant to the question.
+        Grades the retrieved chunks one by one in a concurrent batch and keeps only the relevant ones.
+        Falls back to web search when fewer than `grade_min_relevant` chunks survive.
 
         Args:
             state (messages): The current state
 
         Returns:
-            str: A decision for whether the documents are relevant or not
+            Command: go to generation with the relevant chunks or to web search
         """
 
-        print("---CHECK RELEVANCE---")
-        # LLM with tool and validation
-        llm_with_tool = self.llm.with_structured_output(DocGradeScore, method="json_schema")
-
         question = state["question"]
-        docs = state["messages"][-1].content
+        candidates = self.prefilter(state.get("documents") or [])
+        grades = self.chunk_grader.batch([{"question": question, "doc": doc} for doc in candidates],
+                                         config={"max_concurrency": config.grade_concurrency})
+        return self.route_graded(question, candidates, grades)
 
-        prompt = DOC_GRADER_PROMPT.format(context=docs, question=question)
-        score = llm_with_tool.invoke(prompt).binary_score
-
-        if score == "yes":
-            print("---DECISION: DOCS RELEVANT---")
-            return Command(goto="generate", update={"messages": docs})
-
-        else:
-            print("---DECISION: DOCS NOT RELEVANT---")
-            msg = AIMessage(content="", tool_calls=[
-                            {'name': 'web_search_tool', 'args': {'query': question},
-                            'id': '41d01da6-534d-4aae-824c-b4014ec87e10', 'type': 'tool_call'}])
-
-            return Command(goto="tools", update={"messages": msg})
+    async def agrade_documents(self, state: RagState) -> Command[Literal["generate", "tools"]]:
+        question = state["question"]
+        candidates = self.prefilter(state.get("documents") or [])
+        grades = await self.chunk_grader.abatch([{"question": question, "doc": doc} for doc in candidates],
+                                                config={"max_concurrency": config.grade_concurrency})
+        return self.route_graded(question, candidates, grades)
 
     def edge_condition(self, state: RagState):
         last_message = state["messages"][-1]
@@ -119,18 +174,24 @@ class AgenticRAG:
         else:
             raise RuntimeError("edge_conditions: tool call error")
         if last_tool == "retrieve_research_papers":
-            return Command(update={"last_tool": last_tool}, goto="grader")
+            documents = last_message.artifact or []
+            return Command(update={"last_tool": last_tool, "documents": documents}, goto="grader")
         elif last_tool == "web_search_tool":
-            return Command(update={"last_tool": last_tool}, goto="generate")
+            return Command(update={"last_tool": last_tool, "documents": []}, goto="generate")
         else:
             raise RuntimeError("edge_conditions")
 
     def generate_answer(self, state: RagState):
-        print("---GENERATE---")
         question = state["question"]
-        context = state["messages"][-1].content
+        documents = state.get("documents")
+        if state["last_tool"] == "retrieve_research_papers" and documents:
+            context, stats = pack_context(documents, config.context_token_budget)
+            metrics.inc("context_tokens_saved_total", stats["saved_tokens"])
+            metrics.event("context_packed", **stats)
+        else:
+            context = state["messages"][-1].content
         prompt = RAG_PROMPT.format(context=context, question=question)
-        response = self.llm.invoke(prompt)
+        response = self.stream_llm.with_config(metadata={STREAM_ANSWER: True}).invoke(prompt)
         if state["last_tool"] == "web_search_tool":
             return Command(update={"messages": [response]}, goto=END)
         else:
@@ -138,10 +199,9 @@ class AgenticRAG:
 
     def check_hallucinations(self, state: RagState):
 
-        if config.hallucinations == False:
+        if not runtime_option("hallucinations"):
             return Command(goto=END)
 
-        print("---CHECK HALLUCINATIONS---")
         system_prompt = CHECK_HALLUCINATIONS.format(
             documents=state["context"],
             query=state["question"],
@@ -150,11 +210,11 @@ class AgenticRAG:
         response = self.llm.with_structured_output(GradeHallucinations, method="json_schema").invoke(system_prompt)
         response = response.binary_score
         if response == "yes":
-            print("---NO HALLUCINATIONS---")
+            metrics.event("hallucination_check", grounded=True)
             return Command(goto=END)
         else:
-            print("---HALLUCINATIONS TRUE---")
-            print(state["question"])
+            metrics.inc("rag_fallback_total", reason="hallucination")
+            metrics.event("hallucination_check", grounded=False, question=state["question"])
             msg = AIMessage(content="", tool_calls=[
                 {'name': 'web_search_tool', 'args': {'query': state["question"]},
                  'id': '41d01da6-534d-4aae-824c-b4014ec87333', 'type': 'tool_call'}])
@@ -178,10 +238,11 @@ class EssayWriter:
 
     def __init__(self, llm, retriever):
         self.llm = llm
+        self.stream_llm = uncached(llm)
         self.retriever = retriever
         builder = StateGraph(AgentState)
         builder.add_node("planner", self.plan_node)
-        builder.add_node("research_plan", self.research_plan_node)
+        builder.add_node("research_plan", RunnableLambda(self.research_plan_node, afunc=self.aresearch_plan_node))
         builder.add_node("generate", self.generation_node)
 
         builder.add_edge(START,"planner")
@@ -191,7 +252,6 @@ class EssayWriter:
         self.graph = builder.compile()
 
     def plan_node(self, state: AgentState):
-        print("---CALL ESSAY WRITER---")
         messages = [
             SystemMessage(content=PLAN_PROMPT),
             HumanMessage(content=state['task'])
@@ -199,21 +259,52 @@ class EssayWriter:
         response = self.llm.invoke(messages)
         return {"plan": response.content}
 
+    @staticmethod
+    def unique_queries(queries: Queries) -> list[str]:
+        """
+        De-duplicates queries case and whitespace insensitive, keeping their order.
+        """
+        unique_queries = {}
+        for q in queries.queries:
+            unique_queries.setdefault(" ".join(q.lower().split()), q)
+        return list(unique_queries.values())
+
     def research_plan_node(self, state: AgentState):
         queries = self.llm.with_structured_output(Queries, method="json_schema").invoke([
             SystemMessage(content=RESEARCH_PLAN_PROMPT),
             HumanMessage(content=state['task'])
         ])
 
+        # Run the queries concurrently, results keep query order
+        unique_queries = self.unique_queries(queries)
+        metrics.event("research_queries", count=len(unique_queries))
+        responses = self.retriever.batch([{"messages": [q]} for q in unique_queries],
+                                         config={"max_concurrency": config.research_concurrency})
+
         content = state.get('content') or []
-        for q in queries.queries:
-            response = self.retriever.invoke({"messages": [q]})
+        for response in responses:
+            r = response["messages"][-1].content
+            content.append(r)
+        return {"content": content}
+
+    async def aresearch_plan_node(self, state: AgentState):
+        queries = await self.llm.with_structured_output(Queries, method="json_schema").ainvoke([
+            SystemMessage(content=RESEARCH_PLAN_PROMPT),
+            HumanMessage(content=state['task'])
+        ])
+
+        unique_queries = self.unique_queries(queries)
+        metrics.event("research_queries", count=len(unique_queries))
+        responses = await self.retriever.abatch([{"messages": [q]} for q in unique_queries],
+                                                config={"max_concurrency": config.research_concurrency})
+
+        content = state.get('content') or []
+        for response in responses:
             r = response["messages"][-1].content
             content.append(r)
         return {"content": content}
 
     def generation_node(self, state: AgentState):
-        print("---GENERATE ESSAY---")
         content = "\n\n".join(state['content'] or [])
         user_message = HumanMessage(
             content=f"{state['task']}\n\nHere is my plan:\n\n{state['plan']}")
@@ -223,7 +314,7 @@ class EssayWriter:
             ),
             user_message
         ]
-        response = self.llm.invoke(messages)
+        response = self.stream_llm.with_config(metadata={STREAM_ANSWER: True}).invoke(messages)
         return {
             "draft": response.content,
             "revision_number": state.get("revision_number", 1) + 1
@@ -233,18 +324,25 @@ class EssayWriter:
 class ChatAgent:
     def __init__(self, llm, memory, system="You are helpful assistant"):
         self.llm = llm
+        self.stream_llm = uncached(llm)
         self.system = system
+        self.history = ConversationMemory(llm,
+                                          config.memory_token_budget,
+                                          config.memory_window_turns,
+                                          config.memory_tool_payload_chars)
         builder = StateGraph(MessagesState)
         builder.add_edge(START, "agent")
         builder.add_node("agent", self.call_llm)
         builder.add_edge("agent", END)
         self.graph = builder.compile(checkpointer=memory)
 
-    def call_llm(self, state: MessagesState):
-        print("---CALL CHAT AGENT---")
+    def call_llm(self, state: MessagesState, config: RunnableConfig):
         messages = state["messages"]
         messages = filter_messages(messages, include_types=[HumanMessage, ToolMessage, AIMessage])
+        messages = self.history.prepare(messages, config["configurable"].get("thread_id", ""))
         if self.system:
             messages = [SystemMessage(content=self.system)] + messages
-        response = self.llm.invoke(messages)
+        metrics.inc("prompt_tokens_estimated_total", count_tokens(messages), agent="chat")
+        metrics.event("prompt", agent="chat", tokens=count_tokens(messages))
+        response = self.stream_llm.with_config(metadata={STREAM_ANSWER: True}).invoke(messages)
         return {"messages": [response]}
\ No newline at end of file
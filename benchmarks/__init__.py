@@ -0,0 +1,24 @@
+import os
+
+
+def prepare_environment(workdir: str):
+    """
+    Points every persistent store at `workdir` and switches to offline stand-ins.
+    Must run before `utils` is imported, the settings are read from the environment once.
+    """
+    os.environ.setdefault("DOCUMENTS_PATH", "documents")
+    os.environ.update({
+        "COLLECTION_NAME": "benchmark",
+        "PERSIST_DIRECTORY": os.path.join(workdir, "chroma"),
+        "EMBEDDING_MODEL": "fake-hashing",
+        "EMBEDDING_CACHE_DIRECTORY": os.path.join(workdir, "embedding_cache"),
+        "LLM": "fake",
+        "WEB_CACHE_PATH": os.path.join(workdir, "web_cache.sqlite"),
+        "WEB_OFFLINE": "true",
+        "CHECKPOINT_BACKEND": "memory",
+        "SEMANTIC_CACHE": "false",
+        "LLM_CACHE": "false",
+        "FAST_START": "false",
+    })
+    for name, default in (("RERANKING", "false"), ("HALLUCINATIONS", "true"), ("TOP_K", "5")):
+        os.environ.setdefault(name, default)
@@ -0,0 +1,225 @@
+"""
+Retrieval quality vs latency sweep over retriever combinations, fusion weights, k and reranking.
+Run from the repository root:
+
+    python -m benchmarks.evaluate --questions 50 --k 5 10 20
+    python -m benchmarks.evaluate --offline            # hashing embeddings over a temporary index
+    python -m benchmarks.evaluate --pairs pairs.jsonl  # reuse saved question -> chunk pairs
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from benchmarks import prepare_environment
+from benchmarks.run import git_commit, summarize
+
+
+# Fusion weights of (similarity, MMR, BM25)
+COMBINATIONS = {
+    "similarity": [1.0, 0.0, 0.0],
+    "mmr": [0.0, 1.0, 0.0],
+    "bm25": [0.0, 0.0, 1.0],
+    "similarity+bm25": [0.5, 0.0, 0.5],
+}
+
+QUESTION_PROMPT = """Write one question that is answered by the following passage of a research paper.
+Return only the question.
+
+Passage:
+{passage}"""
+
+
+def load_chunks(builder) -> dict[str, str]:
+    result = builder.vectorstore.get(include=["documents"])
+    return dict(zip(result["ids"], result["documents"]))
+
+
+def key_sentence(text: str, max_words: int = 25) -> str:
+    """
+    Longest sentence of a chunk, cut to `max_words` words, used as a lexical stand-in question.
+    """
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", " ".join(text.split())) if s.strip()]
+    return " ".join(max(sentences, key=len).split()[:max_words]) if sentences else ""
+
+
+def generate_pairs(chunks: dict[str, str], n: int, seed: int, use_llm: bool) -> list[dict]:
+    """
+    Samples `n` chunks and makes a question for each, with the LLM or from a key sentence.
+    Every chunk containing the key sentence (overlapping neighbours) counts as relevant.
+    """
+    rng = random.Random(seed)
+    ids = sorted(chunks)
+    pairs = []
+    for id_ in rng.sample(ids, min(n, len(ids))):
+        sentence = key_sentence(chunks[id_])
+        if len(sentence.split()) < 5:
+            continue
+        if use_llm:
+            from utils import llm
+            question = llm.invoke(QUESTION_PROMPT.format(passage=chunks[id_])).content.strip()
+        else:
+            question = sentence
+        relevant = [other for other, text in chunks.items() if sentence in " ".join(text.split())] or [id_]
+        pairs.append({"question": question, "relevant_ids": relevant})
+    return pairs
+
+
+def score(ranked_ids: list[str], relevant: set[str], cutoffs: list[int]) -> dict:
+    hits = {f"recall@{c}": len(relevant & set(ranked_ids[:c])) / len(relevant) for c in cutoffs}
+    rank = next((i for i, id_ in enumerate(ranked_ids, start=1) if id_ in relevant), None)
+    return {**hits, "mrr": 1.0 / rank if rank else 0.0}
+
+
+def evaluate(retriever, pairs: list[dict], cutoffs: list[int], reranking: bool,
+             rankings: Optional[list] = None) -> dict:
+    """
+    Recall, MRR and latency of `retriever` over the pairs. Ranked ids are appended to `rankings` when given.
+    """
+    from langchain_core.runnables import RunnableLambda
+
+    run_config = {"configurable": {"reranking": reranking, "top_k": max(cutoffs)}}
+    # Runtime options are read from the config of the current run, which a plain retriever.invoke does not set
+    search = RunnableLambda(lambda question: retriever.invoke(question))
+    totals, latencies = {}, []
+    for pair in pairs:
+        start = time.perf_counter()
+        docs = search.invoke(pair["question"], config=run_config)
+        latencies.append(time.perf_counter() - start)
+        if reranking and docs and not any("relevance_score" in doc.metadata for doc in docs):
+            raise RuntimeError("Reranking was requested but the results were not reranked")
+        ranked_ids = [doc.id for doc in docs]
+        if rankings is not None:
+            rankings.append(ranked_ids)
+        for name, value in score(ranked_ids, set(pair["relevant_ids"]), cutoffs).items():
+            totals[name] = totals.get(name, 0.0) + value
+    quality = {name: round(value / len(pairs), 4) for name, value in totals.items()}
+    return {**quality, "latency": summarize(latencies)}
+
+
+def mark_frontier(rows: list[dict], metric: str):
+    """
+    Flags configurations no other configuration beats on both `metric` and p50 latency.
+    """
+    for row in rows:
+        row["frontier"] = not any(
+            other[metric] >= row[metric] and other["latency"]["p50_ms"] <= row["latency"]["p50_ms"]
+            and (other[metric] > row[metric] or other["latency"]["p50_ms"] < row["latency"]["p50_ms"])
+            for other in rows)
+
+
+def run(args) -> dict:
+    from retriever import DocumentProcessor, IndexBuilder
+    from utils import config
+
+    if args.offline:
+        from benchmarks.fakes import HashingEmbeddings
+        builder = IndexBuilder(embeddings=HashingEmbeddings())
+    else:
+        builder = IndexBuilder()
+    builder.build_vectorstore()
+    if args.offline or builder.is_empty():
+        builder.sync_documents(DocumentProcessor.list_documents())
+    # Scores must be computed for every configuration, not served from earlier ones
+    builder.rerank_cache = None
+
+    if args.pairs and os.path.exists(args.pairs):
+        with open(args.pairs) as f:
+            pairs = [json.loads(line) for line in f if line.strip()]
+    else:
+        pairs = generate_pairs(load_chunks(builder), args.questions, args.seed, args.llm_questions)
+        if args.pairs:
+            with open(args.pairs, "w") as f:
+                f.writelines(json.dumps(pair) + "\n" for pair in pairs)
+    print(f"---EVALUATING ON {len(pairs)} QUESTIONS---")
+
+    combinations = {**COMBINATIONS, "ensemble": list(config.ensemble_weights)}
+    for weights in args.weights or []:
+        combinations[f"weights={weights}"] = [float(w) for w in weights.split(",")]
+
+    rows = []
+    for name, weights in combinations.items():
+        for k in args.k:
+            retriever = builder.build_retriever(weights=weights, k=k)
+            rankings = {}
+            for reranking in ([False, True] if args.rerank else [False]):
+                # Untimed pass so query embeddings and the cross-encoder are loaded for every configuration alike
+                try:
+                    evaluate(retriever, pairs[:3], args.at, reranking)
+                except Exception as e:
+                    if not reranking:
+                        raise
+                    print(f"---RERANKING SKIPPED: {e!r}---")
+                    args.rerank = False
+                    continue
+                rankings[reranking] = []
+                row = {"retrievers": name, "weights": weights, "k": k, "reranking": reranking,
+                       **evaluate(retriever, pairs, args.at, reranking, rankings[reranking])}
+                rows.append(row)
+            if rankings.get(True) is not None and rankings[True] == rankings[False]:
+                raise RuntimeError(f"Reranking did not change any ranking of {name} at k={k}, "
+                                   "the runtime options did not reach the retriever")
+    mark_frontier(rows, f"recall@{max(args.at)}")
+
+    return {"meta": {"timestamp": datetime.now(timezone.utc).isoformat(),
+                     "commit": git_commit(),
+                     "offline": args.offline,
+                     "questions": len(pairs),
+                     "embedding_model": config.embedding_model,
+                     "vector_backend": config.vector_backend,
+                     "vector_quantization": config.vector_quantization,
+                     "rerank_model": config.rerank_model},
+            "results": rows}
+
+
+def print_table(rows: list[dict], cutoffs: list[int]):
+    columns = ["retrievers", "k", "rerank"] + [f"recall@{c}" for c in cutoffs] + ["mrr", "p50_ms", "p95_ms", "frontier"]
+    table = [[row["retrievers"], row["k"], row["reranking"]] + [row[f"recall@{c}"] for c in cutoffs]
+             + [row["mrr"], row["latency"]["p50_ms"], row["latency"]["p95_ms"], "*" if row["frontier"] else ""]
+             for row in rows]
+    widths = [max(len(str(value)) for value in [column] + [line[i] for line in table]) for i, column in enumerate(columns)]
+    for line in [columns] + table:
+        print("  ".join(str(value).ljust(width) for value, width in zip(line, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval quality vs latency sweep.")
+    parser.add_argument("--questions", type=int, default=50, help="number of generated questions")
+    parser.add_argument("--pairs", default=None, help="JSONL of question/relevant_ids pairs, written when missing")
+    parser.add_argument("--llm-questions", action="store_true", help="generate questions with the configured LLM")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10, 20], help="results per retriever")
+    parser.add_argument("--at", type=int, nargs="+", default=[1, 5, 10], help="recall cutoffs")
+    parser.add_argument("--weights", nargs="*", help="extra fusion weights, e.g. 0.2,0.2,0.6")
+    parser.add_argument("--no-rerank", dest="rerank", action="store_false", help="skip configurations with reranking")
+    parser.add_argument("--offline", action="store_true", help="hashing embeddings over a temporary index")
+    parser.add_argument("--output", default=None, help="results file, defaults to benchmark_results/eval-<timestamp>.json")
+    args = parser.parse_args()
+
+    workdir = None
+    if args.offline:
+        workdir = tempfile.mkdtemp(prefix="rag-evaluate-")
+        prepare_environment(workdir)
+    try:
+        results = run(args)
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results["results"], args.at)
+    output = args.output or os.path.join("benchmark_results",
+                                         "eval-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"---EVALUATION RESULTS WRITTEN TO {output}---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import RunnableLambda
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from collections import defaultdict
+from typing import Any, Optional
+import hashlib
+import re
+import threading
+import time
+
+import numpy as np
+
+from utils.websearch import web_cache
+
+
+def prompt_text(prompt: Any) -> str:
+    if isinstance(prompt, str):
+        return prompt
+    if isinstance(prompt, PromptValue):
+        return prompt.to_string()
+    return "\n".join(str(message.content) if isinstance(message, BaseMessage) else str(message) for message in prompt)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for ChatOllama. With tools bound it calls the tool named in the
+    human message (the first tool otherwise) with the message as query, structured outputs get
+    `grade` for string fields and three derived queries for list fields, everything else is a canned answer.
+    Every call sleeps `latency` seconds.
+    """
+    latency: float = 0.0
+    grade: str = "yes"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def with_structured_output(self, schema, **kwargs):
+        def respond(prompt):
+            time.sleep(self.latency)
+            text = prompt_text(prompt).strip().splitlines()[-1]
+            values = {}
+            for name, field in schema.model_fields.items():
+                if field.annotation is str:
+                    values[name] = self.grade
+                else:
+                    values[name] = [f"{text} {aspect}" for aspect in ("definition", "method", "results")]
+            return schema(**values)
+
+        return RunnableLambda(respond)
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        tools = kwargs.get("tools")
+        last = messages[-1]
+        if tools and isinstance(last, HumanMessage):
+            names = [tool["function"]["name"] for tool in tools]
+            name = next((n for n in names if n in last.content), names[0])
+            call_id = "call_" + hashlib.sha256(last.content.encode()).hexdigest()[:12]
+            message = AIMessage(content="", tool_calls=[
+                {"name": name, "args": {"query": last.content}, "id": call_id, "type": "tool_call"}])
+        else:
+            message = AIMessage(content=f"Fake answer based on a prompt of {len(prompt_text(messages))} characters.")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings: word hashes are counted into `size` buckets and normalized,
+    so texts sharing words are close.
+    """
+    def __init__(self, size: int = 256):
+        self.size = size
+
+    def embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int.from_bytes(hashlib.md5(word.encode()).digest()[:4], "little") % self.size] += 1.0
+        return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed(text)
+
+
+def seed_web_cache(queries: list[str], pages_per_query: int = 3, max_results: int = 10):
+    """
+    Canned web search backend: caches search results and page paragraphs for the queries,
+    served by the web search tool in offline mode.
+    """
+    for i, query in enumerate(queries):
+        urls = [f"https://example.com/{i}/{j}" for j in range(pages_per_query)]
+        web_cache.put_urls(f"{max_results}:{query}", urls)
+        for url in urls:
+            web_cache.put_page(url, [f"Canned paragraph {k} about {query} from {url}." for k in range(5)])
+
+
+def node_path(metadata: dict) -> str:
+    """
+    Node name prefixed with the names of the enclosing nodes, e.g. `research_plan/generate`.
+    """
+    ns = metadata.get("langgraph_checkpoint_ns") or metadata.get("checkpoint_ns") or metadata["langgraph_node"]
+    return "/".join(part.split(":")[0] for part in ns.split("|"))
+
+
+class NodeTimer(BaseCallbackHandler):
+    """
+    Collects latencies of graph nodes and tools, inherited by nested graphs like ProgressCallbackHandler.
+    """
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self._starts = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, name: str):
+        with self._lock:
+            self._starts[run_id] = (name, time.perf_counter())
+
+    def _end(self, run_id):
+        with self._lock:
+            item = self._starts.pop(run_id, None)
+            if item is not None:
+                self.timings[item[0]].append(time.perf_counter() - item[1])
+
+    def on_chain_start(self, serialized: Optional[dict], inputs: Any, *, run_id, metadata: Optional[dict] = None,
+                       **kwargs: Any):
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and kwargs.get("name") == node:
+            self._start(run_id, node_path(metadata))
+
+    def on_chain_end(self, outputs: Any, *, run_id, **kwargs: Any):
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id, **kwargs: Any):
+        self._end(run_id)
+
+    def on_tool_start(self, serialized: Optional[dict], input_str: str, *, run_id, **kwargs: Any):
+        self._start(run_id, "tool:" + (kwargs.get("name") or (serialized or {}).get("name", "")))
+
+    def on_tool_end(self, output: Any, *, run_id, **kwargs: Any):
+        self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id, **kwargs: Any):
+        self._end(run_id)
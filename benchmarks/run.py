@@ -0,0 +1,193 @@
+"""
+Offline benchmark of ingestion, retrieval and the agent graphs with deterministic stand-ins
+for Ollama and web search. Run from the repository root:
+
+    python -m benchmarks.run --repeats 5 --output benchmark_results/latest.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+import numpy as np
+
+from benchmarks import prepare_environment
+
+
+QUESTIONS = [
+    "What is multi-head latent attention?",
+    "How are mixture of experts layers load balanced?",
+    "How does a large concept model represent sentences as concepts?",
+    "How does the neural long-term memory module decide what to memorize?",
+    "Which benchmarks are used to evaluate long context reasoning?",
+]
+
+# Graded as irrelevant by the web fallback scenario, answered from the canned web backend
+WEB_QUESTIONS = [
+    "What is the latest release of the Ollama server?",
+    "Which conferences accepted papers on test-time memorization?",
+]
+
+
+def summarize(samples: list[float]) -> dict:
+    """
+    Count, mean, p50 and p95 of latencies in milliseconds.
+    """
+    if not samples:
+        return {"n": 0}
+    ms = 1000 * np.asarray(samples)
+    return {"n": len(samples),
+            "mean_ms": round(float(ms.mean()), 3),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3)}
+
+
+def measure(fn: Callable[[str], object], queries: list[str], repeats: int) -> dict:
+    """
+    Latency of `fn` over all queries, after one untimed warmup call per query.
+    """
+    for query in queries:
+        fn(query)
+    samples = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def bench_ingestion(builder, paths: list[str]) -> dict:
+    stats = builder.ingest_documents(paths)
+    seconds = max(stats["seconds"], 1e-9)
+    return {**stats,
+            "pages_per_s": round(stats["pages"] / seconds, 2),
+            "chunks_per_s": round(stats["chunks"] / seconds, 2)}
+
+
+def bench_retrieval(builder, repeats: int) -> dict:
+    from utils.bm25_index import BM25IndexRetriever
+
+    retriever = builder.build_retriever()
+    fusion, reranker = retriever.base_retriever, retriever.reranker.model_copy(update={"cache": None})
+    bm25 = BM25IndexRetriever(index=builder.bm25_index, vectorstore=builder.vectorstore, k=10)
+    results = {
+        "bm25": measure(bm25.invoke, QUESTIONS, repeats),
+        "similarity": measure(lambda q: builder.vectorstore.similarity_search(q, k=10), QUESTIONS, repeats),
+        "mmr": measure(lambda q: builder.vectorstore.max_marginal_relevance_search(q, k=10, fetch_k=20),
+                       QUESTIONS, repeats),
+        "fusion": measure(fusion.invoke, QUESTIONS, repeats),
+    }
+
+    candidates = {q: fusion.invoke(q) for q in QUESTIONS}
+    try:
+        results["rerank"] = measure(lambda q: reranker.compress_documents(candidates[q], q), QUESTIONS, repeats)
+    except Exception as e:
+        results["rerank"] = {"skipped": f"cross-encoder unavailable: {e!r}"}
+    return results
+
+
+def bench_graph(graph, inputs: list[dict], repeats: int, configurable: dict) -> dict:
+    from benchmarks.fakes import NodeTimer
+
+    timer = NodeTimer()
+    config = {"callbacks": [timer], "configurable": configurable}
+    for item in inputs:
+        graph.invoke(item, config)
+    timer.timings.clear()
+
+    samples = []
+    for _ in range(repeats):
+        for item in inputs:
+            start = time.perf_counter()
+            graph.invoke(item, config)
+            samples.append(time.perf_counter() - start)
+    return {"end_to_end": summarize(samples),
+            "nodes": {name: summarize(times) for name, times in sorted(timer.timings.items())}}
+
+
+def run(args) -> dict:
+    from benchmarks.fakes import FakeChatModel, HashingEmbeddings, seed_web_cache
+    from agents.sub_graph import AgenticRAG, EssayWriter
+    from retriever import DocumentProcessor, IndexBuilder, web_search_tool
+    from utils import config
+    from utils.runtime import RetrieverHandle
+    from utils.utils import GradioHandler
+
+    results = {"meta": {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "repeats": args.repeats,
+        "llm_latency_s": args.llm_latency,
+        "settings": {name: getattr(config, name) for name in ("vector_backend", "vector_quantization",
+                                                              "ingest_workers", "ingest_batch_size", "top_k",
+                                                              "reranking", "hallucinations", "rerank_max_candidates",
+                                                              "context_token_budget", "grade_concurrency",
+                                                              "grade_max_chunks")},
+    }}
+
+    print("---BENCHMARK: INGESTION---")
+    builder = IndexBuilder(embeddings=HashingEmbeddings())
+    builder.build_vectorstore()
+    results["ingestion"] = bench_ingestion(builder, DocumentProcessor.list_documents())
+
+    print("---BENCHMARK: RETRIEVAL---")
+    results["retrieval"] = bench_retrieval(builder, args.repeats)
+
+    print("---BENCHMARK: GRAPHS---")
+    seed_web_cache(WEB_QUESTIONS)
+    handle = RetrieverHandle(builder.build_retriever())
+    tools = [GradioHandler.make_retriever_tool(builder, handle), web_search_tool]
+    configurable = {"reranking": "skipped" not in results["retrieval"]["rerank"]}
+    rag = AgenticRAG(FakeChatModel(latency=args.llm_latency), tools).graph
+    web_rag = AgenticRAG(FakeChatModel(latency=args.llm_latency, grade="no"), tools).graph
+    essay = EssayWriter(FakeChatModel(latency=args.llm_latency), rag).graph
+    results["graphs"] = {
+        "agentic_rag": bench_graph(rag, [{"messages": [q]} for q in QUESTIONS], args.repeats, configurable),
+        "agentic_rag_web_fallback": bench_graph(web_rag, [{"messages": [q]} for q in WEB_QUESTIONS], args.repeats,
+                                                configurable),
+        "essay_writer": bench_graph(essay, [{"task": q} for q in QUESTIONS[:2]], args.repeats, configurable),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the retrieval and agent pipeline.")
+    parser.add_argument("--repeats", type=int, default=5, help="timed repetitions of every query")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated seconds per fake LLM call")
+    parser.add_argument("--output", default=None, help="results file, defaults to benchmark_results/<timestamp>.json")
+    parser.add_argument("--workdir", default=None, help="directory of the benchmark stores, temporary by default")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-benchmark-")
+    prepare_environment(workdir)
+    try:
+        results = run(args)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join("benchmark_results",
+                                         datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"---BENCHMARK RESULTS WRITTEN TO {output}---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+PDF parsing and splitting. Kept free of the `utils` package, so ingestion worker processes
+do not load the settings, the models or the checkpointer.
+"""
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from typing import Iterator
+
+
+def iter_page_splits(path: str) -> Iterator[list[Document]]:
+    """
+    Reads a PDF page by page and splits every page as it is read, so only one page is in memory.
+
+    Yields:
+        list[Document]: document splits of one page.
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200, add_start_index=True)
+    try:
+        for page in PyPDFLoader(path).lazy_load():
+            yield text_splitter.split_documents([page])
+    except Exception as e:
+        raise RuntimeError(f"Error processing document {path}: {e}")
+
+
+def split_pdf(path: str) -> list[list[Document]]:
+    """
+    Parses and splits a single PDF. Module level so it can run in worker processes.
+
+    Returns:
+        list[list[Document]]: document splits of every page.
+    """
+    return list(iter_page_splits(path))
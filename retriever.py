@@ -1,20 +1,24 @@
 from langchain_ollama import OllamaEmbeddings
-from langchain_chroma import Chroma
-from langchain_unstructured import UnstructuredLoader
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.cross_encoders import HuggingFaceCrossEncoder
 from langchain_core.documents import Document
-from langchain.retrievers import ContextualCompressionRetriever, EnsembleRetriever
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers.document_compressors import CrossEncoderReranker
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain.tools import tool
+from langchain_core.embeddings import Embeddings
+from langchain_core.tools import StructuredTool
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterator, Optional
 import asyncio
+import multiprocessing
 import os
+import time
 
+from loaders import iter_page_splits, split_pdf
 from utils import config
-from utils.websearch import web_search_text
+from utils.metrics import metrics
+from utils.websearch import web_cache, web_search_text
+from utils.bm25_index import BM25Index, BM25IndexRetriever
+from utils.ensemble import FusionRetriever
+from utils.embedding_cache import CachedEmbeddings, EmbeddingCache
+from utils.reranker import BatchedCrossEncoderReranker, RuntimeRerankRetriever, ScoreCache
+from utils.manifest import IngestionManifest, UPLOADS_PREFIX, chunk_id, file_hash
 
 
 class DocumentProcessor:
@@ -22,43 +26,68 @@ class DocumentProcessor:
     Handles document loading and splitting.
     """
     @staticmethod
-    def load_pdf(path) -> list[Document]:
-        try:
-            docs = PyPDFLoader(path).load()
-        except Exception as e:
-            raise RuntimeError(f"Error processing document: {e}")
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
-        doc_splits = text_splitter.split_documents(docs)
-        return doc_splits
+    def list_documents() -> list[str]:
+        """
+        Lists PDF files in the documents directory.
+        """
+        directory = os.path.join(os.getcwd(), config.documents_path)
+        return [os.path.join(config.documents_path, doc) for doc in sorted(os.listdir(directory))
+                if doc.lower().endswith(".pdf")]
 
     @staticmethod
-    def load_documents() -> list[Document]:
+    def iter_pdfs(paths: list[str], workers: int = 1) -> Iterator[tuple[str, Iterator[list[Document]]]]:
         """
-        Loading PDF documents from directory and preprocess them for vectorstore.
-
-        Returns:
-            list[Document]: list of preprocessed documents.
+        Parses and splits PDFs, yielding the page splits of every file.
+        Files of at least `config.ingest_stream_min_bytes` (all files when `workers` is 1) are streamed
+        page by page in the calling process, so memory does not grow with their size. Smaller files are
+        split in a process pool meanwhile, with at most 2 * workers files in flight so results do not
+        pile up when the consumer is slower.
+
+        Yields:
+            tuple[str, Iterator[list[Document]]]: path and the document splits of every page of one file.
         """
-        print("---LOADING DOCUMENTS---")
-        try:
-            docs = [PyPDFLoader(os.path.join(config.documents_path, doc)).load() for doc in os.listdir(os.path.join(os.getcwd(), config.documents_path))]
-        except Exception as e:
-            raise RuntimeError(f"Error processing document: {e}")
-
-        docs_list = [item for sublist in docs for item in sublist]
-        print("---SPLITTING DOCUMENTS---")
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
-        doc_splits = text_splitter.split_documents(docs_list)
-        return doc_splits
+        streamed = {path for path in paths if workers <= 1 or os.path.getsize(path) >= config.ingest_stream_min_bytes}
+        if len(streamed) == len(paths):
+            for path in paths:
+                yield path, iter_page_splits(path)
+            return
+
+        pooled = iter([path for path in paths if path not in streamed])
+        # Forking would copy the locks held by the warmup, ingestion and Gradio threads into the workers
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver")) as pool:
+            pending = {}
+
+            def submit():
+                for path in pooled:
+                    pending[pool.submit(split_pdf, path)] = path
+                    if len(pending) >= 2 * workers:
+                        break
+
+            submit()
+            for path in paths:
+                if path in streamed:
+                    yield path, iter_page_splits(path)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), iter(future.result())
+                submit()
 
     @staticmethod
-    def load_web(urls: list[str]) -> list[str]:
+    async def aload_web(urls: list[str]) -> list[str]:
         """
-        Loading end preprocess web pages content from given urls.
+        Concurrently loading and preprocess web pages content from given urls.
+        Every page has its own timeout and the whole call a global deadline. Returns as soon as
+        enough paragraphs are collected and cancels the remaining fetches.
+        Pages found in the web cache are served from it, in offline mode nothing else is fetched.
 
         Returns:
             list[str]: list pages content.
         """
+        from langchain_unstructured import UnstructuredLoader
+
+        semaphore = asyncio.Semaphore(config.web_max_connections)
+
         async def load_(url: str) -> list[str]:
             loader = UnstructuredLoader(web_url=url)
             setup_docs = []
@@ -67,85 +96,328 @@ class DocumentProcessor:
                     setup_docs.append(doc.page_content)
             return setup_docs
 
-        print("---LOADING WEB PAGES---")
+        async def fetch(url: str) -> list[str]:
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    content = await asyncio.wait_for(load_(url), timeout=config.web_request_timeout)
+                except Exception as e:
+                    metrics.inc("web_fetch_errors_total")
+                    metrics.event("web_fetch_failed", url=url, error=repr(e))
+                    return []
+                finally:
+                    metrics.observe("web_fetch_seconds", time.perf_counter() - start)
+            web_cache.put_page(url, content)
+            return content
+
         web_content = []
+        to_fetch = []
         for url in urls:
-            page_setup_docs = asyncio.run(load_(url))
-            web_content.extend(page_setup_docs)
-            if len(web_content) == 3: break
+            cached = web_cache.get_page(url)
+            if cached is None:
+                to_fetch.append(url)
+            else:
+                web_content.extend(cached)
+        metrics.inc("web_page_cache_hits_total", len(urls) - len(to_fetch))
+        metrics.inc("web_page_cache_misses_total", len(to_fetch))
+        if len(web_content) >= config.web_min_paragraphs or web_cache.offline:
+            metrics.event("web_pages_from_cache", pages=len(urls) - len(to_fetch))
+            return web_content
+
+        metrics.event("loading_web_pages", pages=len(to_fetch))
+        tasks = [asyncio.create_task(fetch(url)) for url in to_fetch]
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=config.web_deadline):
+                web_content.extend(await next_done)
+                if len(web_content) >= config.web_min_paragraphs:
+                    break
+        except asyncio.TimeoutError:
+            metrics.inc("web_deadline_exceeded_total")
+            metrics.event("web_deadline_exceeded", paragraphs=len(web_content))
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
         return web_content
 
+    @staticmethod
+    def load_web(urls: list[str]) -> list[str]:
+        """
+        Synchronous wrapper of `aload_web`, also usable from a thread with a running event loop.
 
-@tool
-def web_search_tool(query: str) -> str:
-    """Performs a web search and returns the top 5 result snippet."""
+        Returns:
+            list[str]: list pages content.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(DocumentProcessor.aload_web(urls))
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(asyncio.run, DocumentProcessor.aload_web(urls)).result()
+
+
+def web_search(query: str) -> str:
     urls = web_search_text(query)
     docs = DocumentProcessor.load_web(urls)
     result = "\n".join(docs)
     return result
 
 
+async def aweb_search(query: str) -> str:
+    urls = await asyncio.to_thread(web_search_text, query)
+    docs = await DocumentProcessor.aload_web(urls)
+    result = "\n".join(docs)
+    return result
+
+
+web_search_tool = StructuredTool.from_function(
+    func=web_search,
+    coroutine=aweb_search,
+    name="web_search_tool",
+    description="Performs a web search and returns the top 5 result snippet.",
+)
+
+
 
 class IndexBuilder:
 
-    def __init__(self):
+    def __init__(self, embeddings: Optional[Embeddings] = None):
+        """
+        Args:
+            embeddings (Optional[Embeddings]): embedding model, defaults to `config.embedding_model` served by Ollama.
+        """
         self.vectorstore = None
-        self.embeddings = OllamaEmbeddings(model=config.embedding_model)
-        self.model = HuggingFaceCrossEncoder(model_name="cross-encoder/ms-marco-MiniLM-L-6-v2")
+        self.embedding_cache = EmbeddingCache.for_model(config.embedding_cache_directory,
+                                                        config.embedding_model,
+                                                        config.embedding_cache_size)
+        self.embeddings = CachedEmbeddings(embeddings or OllamaEmbeddings(model=config.embedding_model),
+                                           self.embedding_cache)
+        self.rerank_cache = ScoreCache(os.path.join(config.persist_directory, "rerank_scores.sqlite"))
+        # Every backend keeps its own BM25 index and manifest so switching backends reindexes the new one
+        self.index_directory = config.persist_directory if config.vector_backend == "chroma" \
+            else os.path.join(config.persist_directory, f"{config.vector_backend}_{config.collection_name}")
+        os.makedirs(self.index_directory, exist_ok=True)
+        self.bm25_index = BM25Index(os.path.join(self.index_directory, "bm25.sqlite"))
+        self.manifest = IngestionManifest(os.path.join(self.index_directory, "manifest.json"))
+        self.change_listeners = []
 
     def build_vectorstore(self):
         """
-        Initializes the Chroma vectorstore with the provided embeddings.
+        Initializes the vectorstore of `config.vector_backend` with the provided embeddings.
         """
         try:
-            print("---BUILDING VECTORSTORE---")
-            self.vectorstore = Chroma(collection_name=config.collection_name,
-                                      embedding_function=self.embeddings,
-                                      persist_directory=config.persist_directory)
+            metrics.event("building_vectorstore", backend=config.vector_backend)
+            if config.vector_backend == "numpy":
+                from utils.numpy_store import NumpyVectorStore
+                self.vectorstore = NumpyVectorStore(self.index_directory, self.embeddings,
+                                                    quantization=config.vector_quantization,
+                                                    rescore_factor=config.vector_rescore_factor)
+            else:
+                from langchain_chroma import Chroma
+                self.vectorstore = Chroma(collection_name=config.collection_name,
+                                          embedding_function=self.embeddings,
+                                          persist_directory=config.persist_directory)
         except Exception as e:
             raise RuntimeError(f"Error building vectorstore: {e}")
 
-    def pull_documents(self, docs: list):
+    def add_change_listener(self, listener: Callable[[], None]):
         """
-        Pulling list of document in vectorstore.
+        Registers a callback invoked after documents are added to or deleted from the collection.
+        """
+        self.change_listeners.append(listener)
+
+    def _notify_change(self):
+        for listener in self.change_listeners:
+            listener()
+
+    def is_empty(self) -> bool:
+        return len(self.vectorstore.get(limit=1, include=[])["ids"]) == 0
+
+    def pull_documents(self, docs: list, ids: Optional[list[str]] = None):
+        """
+        Pulling list of document in vectorstore and BM25 index.
         """
         try:
-            print("---PULL DOCUMENTS IN VECTORSTORE---")
-            self.vectorstore.add_documents(docs)
+            with metrics.timed("index_add", chunks=len(docs)):
+                ids = self.vectorstore.add_documents(docs, ids=ids)
+                self.bm25_index.add(ids, [doc.page_content for doc in docs])
         except Exception as e:
             raise RuntimeError(f"Error pulling documents: {e}")
+        self._notify_change()
 
-    def build_retriever(self):
+    def delete_documents(self, ids: list[str], batch_size: int = 1000):
         """
-        Builds BM25 and vector-based retrievers and combines them into an ensemble retriever, default or with reranking.
+        Deleting documents from vectorstore and BM25 index.
+        """
+        try:
+            with metrics.timed("index_delete", chunks=len(ids)):
+                for i in range(0, len(ids), batch_size):
+                    self.vectorstore.delete(ids[i:i + batch_size])
+                self.bm25_index.delete(ids)
+                self.bm25_index.compact_if_needed(config.bm25_max_dead_fraction, config.bm25_max_segments)
+        except Exception as e:
+            raise RuntimeError(f"Error deleting documents: {e}")
+        self._notify_change()
+
+    def ingest_documents(self, paths: list[str], keys: Optional[list[str]] = None,
+                         progress: Optional[Callable[[dict], None]] = None) -> dict:
+        """
+        Pipelined ingestion: PDFs are parsed and split page by page (small files in a process pool)
+        while previous batches are embedded and written to the vectorstore. At most one batch is being
+        written and one filled, so memory is bounded by the batch size rather than the document size.
+        Chunks already recorded in the manifest for the same file are not embedded again,
+        chunks that disappeared from a changed file are deleted.
+
+        Args:
+            paths (list[str]): paths of PDF files to ingest.
+            keys (Optional[list[str]]): manifest keys of the files, defaults to the paths.
+            progress (Optional[Callable[[dict], None]]): called with the numbers of finished files, read pages
+                and embedded chunks after every file and written batch.
+
+        Returns:
+            dict: number of files, pages and new chunks and the elapsed seconds.
+        """
+        metrics.event("ingesting_documents", files=len(paths))
+        keys = dict(zip(paths, keys or paths))
+        batch_size = config.ingest_batch_size
+        start = time.perf_counter()
+        pages, chunks = 0, 0
+        files, embedded = 0, 0
+        batch = []
+
+        def report():
+            if progress is not None:
+                progress({"files": files, "pages": pages, "chunks": embedded})
+
+        def flush(items: list[tuple[str, Document]]):
+            nonlocal embedded
+            self.pull_documents([doc for _, doc in items], [id_ for id_, _ in items])
+            embedded += len(items)
+            report()
+
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending = None
+            for path, page_splits in DocumentProcessor.iter_pdfs(paths, config.ingest_workers):
+                key = keys[path]
+                known = set(self.manifest.chunks(key))
+                file_chunks = {}
+                for splits in page_splits:
+                    pages += 1
+                    for doc in splits:
+                        id_ = chunk_id(key, doc)
+                        if id_ not in file_chunks and id_ not in known:
+                            batch.append((id_, doc))
+                        file_chunks[id_] = None
+                    while len(batch) >= batch_size:
+                        if pending is not None:
+                            pending.result()
+                        pending = writer.submit(flush, batch[:batch_size])
+                        chunks += batch_size
+                        batch = batch[batch_size:]
+                stale = [id_ for id_ in known if id_ not in file_chunks]
+                if stale:
+                    self.delete_documents(stale)
+                self.manifest.set(key, path, file_hash(path), list(file_chunks))
+                files += 1
+                report()
+            if pending is not None:
+                pending.result()
+            if batch:
+                flush(batch)
+                chunks += len(batch)
+        self.manifest.save()
+        self.bm25_index.compact_if_needed(config.bm25_max_dead_fraction, config.bm25_max_segments)
+
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        metrics.inc("ingested_pages_total", pages)
+        metrics.inc("ingested_chunks_total", chunks)
+        metrics.observe("ingest_seconds", elapsed)
+        metrics.event("ingested", files=len(paths), pages=pages, chunks=chunks, seconds=round(elapsed, 1),
+                      pages_per_s=round(pages / elapsed, 1), chunks_per_s=round(chunks / elapsed, 1),
+                      embedding_cache=self.embedding_cache.stats())
+        return {"files": len(paths), "pages": pages, "chunks": chunks, "seconds": elapsed}
+
+    def sync_documents(self, paths: list[str]):
+        """
+        Brings the index in line with the documents directory: ingests new and changed files and
+        deletes chunks of removed files. Uploaded files are kept. A collection built before the
+        manifest existed is reindexed once.
+
+        Args:
+            paths (list[str]): paths of PDF files currently in the documents directory.
+        """
+        metrics.event("syncing_documents")
+        if not self.manifest.exists and not self.is_empty():
+            metrics.event("no_manifest_reindexing_collection")
+            self.delete_documents(self.vectorstore.get(include=[])["ids"])
+
+        current = set(paths)
+        removed = [key for key in self.manifest.files if not key.startswith(UPLOADS_PREFIX) and key not in current]
+        for key in removed:
+            self.delete_documents(self.manifest.chunks(key))
+            self.manifest.remove(key)
+
+        changed = [path for path in paths if not self.manifest.is_unchanged(path, path)]
+        if changed:
+            self.ingest_documents(changed)
+        else:
+            self.manifest.save()
+        metrics.event("documents_synced", ingested=len(changed), removed=len(removed))
+
+    def sync_bm25_index(self, batch_size: int = 1000):
+        """
+        Backfills an empty BM25 index from a vectorstore that was populated before the index existed.
+        """
+        if len(self.bm25_index) > 0 or self.is_empty():
+            return
+        metrics.event("backfilling_bm25_index")
+        offset = 0
+        while True:
+            batch = self.vectorstore.get(limit=batch_size, offset=offset, include=["documents"])
+            if not batch["ids"]:
+                break
+            self.bm25_index.add(batch["ids"], batch["documents"])
+            offset += len(batch["ids"])
+
+    def build_retriever(self, weights: Optional[list[float]] = None, k: Optional[int] = None):
+        """
+        Builds BM25 and vector-based retrievers and combines them into an ensemble retriever.
+        Reranking and the number of reranked chunks are runtime options read on every query.
+
+        Args:
+            weights (Optional[list[float]]): fusion weights of similarity, MMR and BM25, defaults to `config.ensemble_weights`.
+            k (Optional[int]): results per retriever, defaults to `config.ensemble_k`.
 
         Returns:
-            ContextualCompressionRetriever: retriever with reranking.
+            RuntimeRerankRetriever: ensemble retriever with optional reranking.
         """
         try:
-            print("---BUILDING BM25 RETRIEVER---")
-            ids = self.vectorstore.get()["ids"]
-            bm25_retriever = BM25Retriever.from_documents(self.vectorstore.get_by_ids(ids), search_kwargs={"k": 10})
+            metrics.event("building_bm25_retriever")
+            self.sync_bm25_index()
+            bm25_retriever = BM25IndexRetriever(index=self.bm25_index, vectorstore=self.vectorstore,
+                                                k=k or config.ensemble_k)
 
         except Exception as e:
             raise RuntimeError(f"Error building BM25 retriever: {e}")
 
         try:
-            print("---BUILDING MMR RETRIEVER---")
-            mmr_retriever = self.vectorstore.as_retriever(search_type="mmr", k=10)
-            print("---BUILDING SIMILARITY RETRIEVER---")
-            sim_retriever = self.vectorstore.as_retriever(search_type="similarity", k=10)
-            print("---COMBINING RETRIEVERS---")
-            ensemble_retriever = EnsembleRetriever(
-                retrievers=[sim_retriever, mmr_retriever, bm25_retriever],
-                weights=[0.3, 0.3, 0.4],
+            metrics.event("combining_retrievers")
+            ensemble_retriever = FusionRetriever(
+                vectorstore=self.vectorstore,
+                embeddings=self.embeddings,
+                bm25_retriever=bm25_retriever,
+                weights=weights or config.ensemble_weights,
+                k=k or config.ensemble_k,
+                fetch_k=2 * (k or config.ensemble_k),
             )
-            if config.reranking:
-                print("---BUILDING RETRIEVER WITH RERANKING---")
-                compressor = CrossEncoderReranker(model=self.model, top_n=config.top_k)
-                ensemble_retriever = ContextualCompressionRetriever(
-                    base_compressor=compressor, base_retriever=ensemble_retriever
-                )
+            compressor = BatchedCrossEncoderReranker(model_name=config.rerank_model,
+                                                     top_n=config.top_k,
+                                                     max_candidates=config.rerank_max_candidates,
+                                                     batch_size=config.rerank_batch_size,
+                                                     max_length=config.rerank_max_length,
+                                                     num_threads=config.rerank_threads,
+                                                     cache=self.rerank_cache)
+            ensemble_retriever = RuntimeRerankRetriever(base_retriever=ensemble_retriever, reranker=compressor)
         except Exception as e:
             raise RuntimeError(f"Error pulling documents: {e}")
 
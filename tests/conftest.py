@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import prepare_environment
+
+# Settings are read once when `utils` is imported, point every store at a temporary directory first
+prepare_environment(tempfile.mkdtemp(prefix="rag-tests-"))
@@ -0,0 +1,56 @@
+from utils.bm25_index import BM25Index
+
+
+def postings_bytes(index: BM25Index) -> int:
+    return index.conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM segments").fetchone()[0]
+
+
+def test_deletes_leave_dead_postings_until_compaction(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite"))
+    ids = [f"chunk-{i}" for i in range(10)]
+    index.add(ids, [f"attention layer number {i}" for i in range(10)])
+    before = postings_bytes(index)
+
+    index.delete(ids[:5])
+    assert postings_bytes(index) == before
+    assert index.dead_fraction == 0.5
+
+    assert index.compact_if_needed(0.2, max_segments=64)
+    assert postings_bytes(index) < before
+    assert index.dead_fraction == 0.0
+    assert {chunk_id for chunk_id, _ in index.search("attention", k=10)} == set(ids[5:])
+
+
+def test_compaction_waits_for_the_dead_fraction(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite"))
+    ids = [f"chunk-{i}" for i in range(10)]
+    index.add(ids, [f"mixture of experts {i}" for i in range(10)])
+    before = postings_bytes(index)
+
+    index.delete(ids[:1])
+    assert not index.compact_if_needed(0.2, max_segments=64)
+    assert postings_bytes(index) == before
+
+
+def test_dead_fraction_is_persisted(tmp_path):
+    path = str(tmp_path / "bm25.sqlite")
+    index = BM25Index(path)
+    index.add(["a", "b"], ["latent attention", "latent concept"])
+    index.delete(["a"])
+    assert BM25Index(path).dead_fraction == 0.5
+
+
+def test_adds_write_new_segments_merged_by_compaction(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite"))
+    for batch in range(4):
+        ids = [f"chunk-{batch}-{i}" for i in range(5)]
+        index.add(ids, [f"sparse attention block {batch} {i}" for i in range(5)])
+    rows = index.conn.execute("SELECT COUNT(*) FROM segments WHERE term = 'attention'").fetchone()[0]
+    assert rows == 4 and index.segments == 4
+    before = index.search("attention block", k=20)
+
+    assert not index.compact_if_needed(0.2, max_segments=4)
+    assert index.compact_if_needed(0.2, max_segments=3)
+    rows = index.conn.execute("SELECT COUNT(*) FROM segments WHERE term = 'attention'").fetchone()[0]
+    assert rows == 1 and index.segments == 1
+    assert index.search("attention block", k=20) == before
@@ -0,0 +1,36 @@
+from langchain_core.documents import Document
+
+from utils.context import Passage, merge_group, pack_context
+
+
+def test_merge_overlapping_chunks():
+    text = "".join(chr(ord("a") + i % 26) for i in range(80))
+    merged = merge_group([Passage(text[30:80], 1.0, 30), Passage(text[:50], 2.0, 0)])
+    assert len(merged) == 1
+    assert merged[0].text == text
+    assert merged[0].score == 2.0
+
+
+def test_merge_touching_chunks():
+    merged = merge_group([Passage("A" * 50, 1.0, 0), Passage("B" * 50, 1.0, 50)])
+    assert [p.text for p in merged] == ["A" * 50 + "B" * 50]
+
+
+def test_chunks_with_a_gap_are_kept_apart():
+    merged = merge_group([Passage("A" * 50, 1.0, 0), Passage("B" * 50, 1.0, 51)])
+    assert [p.text for p in merged] == ["A" * 50, "B" * 50]
+
+
+def test_disjoint_chunks_are_kept_apart():
+    merged = merge_group([Passage("B" * 50, 1.0, 500), Passage("A" * 50, 1.0, 0)])
+    assert [p.text for p in merged] == ["A" * 50, "B" * 50]
+
+
+def test_pack_context_keeps_text_of_separate_chunks():
+    first = " ".join(f"alpha{i}" for i in range(10))
+    second = " ".join(f"beta{i}" for i in range(10))
+    docs = [Document(page_content=first, metadata={"source": "a.pdf", "page": 0, "start_index": 0}),
+            Document(page_content=second, metadata={"source": "a.pdf", "page": 0, "start_index": len(first) + 1})]
+    context, stats = pack_context(docs, token_budget=1000)
+    assert first in context and second in context
+    assert stats["saved_tokens"] == 0
@@ -1,4 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Literal
 import os
 
 class Settings(BaseSettings):
@@ -12,10 +13,65 @@ class Settings(BaseSettings):
     top_k: int
     embedding_model: str
     llm: str
+    ingest_workers: int = os.cpu_count() or 1
+    ingest_batch_size: int = 256
+    ingest_stream_min_bytes: int = 16 * 1024 * 1024
+    ingest_job_workers: int = 1
+    embedding_cache_directory: str = "embedding_cache"
+    embedding_cache_size: int = 100_000
+    semantic_cache: bool = True
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_size: int = 256
+    semantic_cache_ttl: int = 3600
+    web_max_connections: int = 5
+    web_request_timeout: float = 10.0
+    web_deadline: float = 20.0
+    web_min_paragraphs: int = 3
+    web_cache_path: str = "web_cache/web_cache.sqlite"
+    web_cache_ttl: int = 86400
+    web_cache_max_bytes: int = 200 * 1024 * 1024
+    web_offline: bool = False
+    vector_backend: Literal["chroma", "numpy"] = "chroma"
+    vector_quantization: Literal["none", "float16", "int8"] = "none"
+    vector_rescore_factor: int = 4
+    bm25_max_dead_fraction: float = 0.2
+    bm25_max_segments: int = 64
+    ensemble_weights: list[float] = [0.3, 0.3, 0.4]
+    ensemble_k: int = 10
+    rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    rerank_max_candidates: int = 20
+    rerank_batch_size: int = 16
+    rerank_max_length: int = 512
+    rerank_threads: int = 0
+    research_concurrency: int = 3
+    max_concurrent_runs: int = 4
+    checkpoint_backend: Literal["sqlite", "memory"] = "sqlite"
+    checkpoint_path: str = "checkpoints/checkpoints.sqlite"
+    checkpoint_max_per_thread: int = 10
+    checkpoint_idle_seconds: int = 7 * 24 * 3600
+    checkpoint_compaction_interval: int = 600
+    memory_token_budget: int = 3000
+    memory_window_turns: int = 4
+    memory_tool_payload_chars: int = 300
+    context_token_budget: int = 3000
+    grade_concurrency: int = 4
+    grade_min_relevant: int = 1
+    grade_min_rerank_score: float = -5.0
+    grade_max_chunks: int = 8
+    fast_start: bool = True
+    metrics_console: bool = True
+    metrics_trace_path: str = ""
+    metrics_port: int = 0
+    llm_cache: bool = True
+    llm_cache_path: str = "llm_cache/llm_cache.sqlite"
+    llm_cache_ttl: int = 7 * 24 * 3600
+    llm_cache_max_entries: int = 10_000
 
 config = Settings()
 
-from langgraph.checkpoint.memory import MemorySaver
 from langchain_ollama import ChatOllama
-llm = ChatOllama(model=config.llm, temperature=0)
-memory = MemorySaver()
\ No newline at end of file
+from utils.checkpoint import build_checkpointer
+from utils.metrics import metrics_callback
+from utils.llm_cache import build_llm_cache
+llm = ChatOllama(model=config.llm, temperature=0, callbacks=[metrics_callback], cache=build_llm_cache())
+memory = build_checkpointer()
\ No newline at end of file
@@ -0,0 +1,280 @@
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from array import array
+from collections import Counter, defaultdict
+import heapq
+import math
+import os
+import re
+import sqlite3
+import threading
+
+from utils.metrics import metrics
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_no INTEGER PRIMARY KEY AUTOINCREMENT,
+    chunk_id TEXT UNIQUE NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    term TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (term, segment)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    On-disk inverted index with Okapi BM25 scoring.
+
+    Every term maps to packed arrays of (doc_no, term frequency) pairs, one per segment: every `add`
+    writes a new segment, so existing postings are never rewritten while indexing. Only chunk ids and
+    lengths are stored for documents, chunk text stays in the vectorstore and is fetched for the final hits.
+    Deleted documents leave dead postings behind until `compact` merges the segments of every term and
+    drops them, `compact_if_needed` does so once there are too many segments or dead documents.
+    """
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._conn = None
+        self._lengths = None
+        self._n_docs = 0
+        self._total_length = 0
+        self._dead_docs = 0
+        self._segments = 0
+        self._lock = threading.RLock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(SCHEMA)
+            legacy = self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'postings'").fetchone()
+            if legacy is not None:
+                # Single-blob postings of earlier versions become segment 0
+                with self._conn:
+                    self._conn.execute("INSERT OR IGNORE INTO segments (term, segment, data) "
+                                       "SELECT term, 0, data FROM postings")
+                    self._conn.execute("DROP TABLE postings")
+                    self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('segments', 1)")
+        return self._conn
+
+    def _load(self):
+        """
+        Loads document lengths into memory on first use, indexed by doc_no (0 means deleted).
+        """
+        if self._lengths is not None:
+            return
+        with metrics.timed("bm25_load") as fields:
+            lengths = array("I")
+            n_docs, total_length = 0, 0
+            for doc_no, length in self.conn.execute("SELECT doc_no, length FROM docs"):
+                if doc_no >= len(lengths):
+                    lengths.extend([0] * (doc_no + 1 - len(lengths)))
+                lengths[doc_no] = length
+                n_docs += 1
+                total_length += length
+            fields["docs"] = n_docs
+        self._lengths = lengths
+        self._n_docs = n_docs
+        self._total_length = total_length
+        meta = dict(self.conn.execute("SELECT name, value FROM meta").fetchall())
+        self._dead_docs = meta.get("dead_docs", 0)
+        self._segments = meta.get("segments", 0)
+
+    def _set_dead_docs(self, value: int):
+        self._dead_docs = value
+        self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dead_docs', ?)", (value,))
+
+    def _set_segments(self, value: int):
+        self._segments = value
+        self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('segments', ?)", (value,))
+
+    @property
+    def segments(self) -> int:
+        """
+        Number of postings segments written since the last compaction.
+        """
+        with self._lock:
+            self._load()
+            return self._segments
+
+    @property
+    def dead_fraction(self) -> float:
+        """
+        Share of deleted documents among all documents with postings.
+        """
+        with self._lock:
+            self._load()
+            total = self._n_docs + self._dead_docs
+            return self._dead_docs / total if total else 0.0
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return self._n_docs
+
+    def add(self, ids: list[str], texts: list[str]):
+        """
+        Adds chunks to the index. Ids that are already indexed are skipped.
+
+        Args:
+            ids (list[str]): vectorstore ids of the chunks.
+            texts (list[str]): chunk texts, used only to build postings.
+        """
+        with self._lock, self.conn:
+            self._load()
+            new_postings = defaultdict(lambda: array("I"))
+            for chunk_id, text in zip(ids, texts):
+                tokens = tokenize(text)
+                cursor = self.conn.execute("INSERT OR IGNORE INTO docs (chunk_id, length) VALUES (?, ?)",
+                                           (chunk_id, len(tokens)))
+                if cursor.rowcount == 0:
+                    continue
+                doc_no = cursor.lastrowid
+                if doc_no >= len(self._lengths):
+                    self._lengths.extend([0] * (doc_no + 1 - len(self._lengths)))
+                self._lengths[doc_no] = len(tokens)
+                self._n_docs += 1
+                self._total_length += len(tokens)
+                for term, tf in Counter(tokens).items():
+                    new_postings[term].extend((doc_no, tf))
+
+            if new_postings:
+                segment = self._segments
+                self.conn.executemany("INSERT INTO segments (term, segment, data) VALUES (?, ?, ?)",
+                                      [(term, segment, data.tobytes()) for term, data in new_postings.items()])
+                self._set_segments(segment + 1)
+
+    def delete(self, ids: list[str]):
+        """
+        Removes chunks from the index.
+        """
+        with self._lock, self.conn:
+            self._load()
+            deleted = 0
+            for chunk_id in ids:
+                row = self.conn.execute("SELECT doc_no, length FROM docs WHERE chunk_id = ?", (chunk_id,)).fetchone()
+                if row is None:
+                    continue
+                doc_no, length = row
+                self.conn.execute("DELETE FROM docs WHERE doc_no = ?", (doc_no,))
+                self._lengths[doc_no] = 0
+                self._n_docs -= 1
+                self._total_length -= length
+                deleted += 1
+            if deleted:
+                self._set_dead_docs(self._dead_docs + deleted)
+
+    def compact(self):
+        """
+        Merges the segments of every term into one, without entries of deleted documents.
+        """
+        with self._lock, metrics.timed("bm25_compact") as fields:
+            self._load()
+            fields.update(dead_docs=self._dead_docs, segments=self._segments)
+            with self.conn:
+                self._compact_postings()
+                self._set_dead_docs(0)
+                self._set_segments(1)
+            self.conn.execute("VACUUM")
+
+    def compact_if_needed(self, max_dead_fraction: float, max_segments: int) -> bool:
+        """
+        Compacts the index when deleted documents exceed `max_dead_fraction` of all documents with postings
+        or more than `max_segments` segments were written since the last compaction.
+
+        Returns:
+            bool: whether the index was compacted.
+        """
+        with self._lock:
+            too_many_dead = self._dead_docs > 0 and self.dead_fraction >= max_dead_fraction
+            if not too_many_dead and self.segments <= max_segments:
+                return False
+            self.compact()
+            return True
+
+    def _read_postings(self, term: str) -> array:
+        pairs = array("I")
+        for (data,) in self.conn.execute("SELECT data FROM segments WHERE term = ? ORDER BY segment", (term,)):
+            pairs.frombytes(data)
+        return pairs
+
+    def _compact_postings(self):
+        terms = [term for (term,) in self.conn.execute("SELECT DISTINCT term FROM segments").fetchall()]
+        for term in terms:
+            pairs = self._read_postings(term)
+            live = array("I")
+            for i in range(0, len(pairs), 2):
+                if self._lengths[pairs[i]]:
+                    live.extend(pairs[i:i + 2])
+            self.conn.execute("DELETE FROM segments WHERE term = ?", (term,))
+            if live:
+                self.conn.execute("INSERT INTO segments (term, segment, data) VALUES (?, 0, ?)", (term, live.tobytes()))
+
+    def search(self, query: str, k: int = 10) -> list[tuple[str, float]]:
+        """
+        Scores indexed chunks against the query.
+
+        Returns:
+            list[tuple[str, float]]: up to k (chunk id, score) pairs, best first.
+        """
+        with self._lock:
+            self._load()
+            if self._n_docs == 0:
+                return []
+            avgdl = self._total_length / self._n_docs
+            scores = defaultdict(float)
+            for term, qtf in Counter(tokenize(query)).items():
+                pairs = self._read_postings(term)
+                live = [(pairs[i], pairs[i + 1]) for i in range(0, len(pairs), 2) if self._lengths[pairs[i]]]
+                if not live:
+                    continue
+                idf = math.log((self._n_docs - len(live) + 0.5) / (len(live) + 0.5) + 1)
+                for doc_no, tf in live:
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_no] / avgdl)
+                    scores[doc_no] += qtf * idf * tf * (self.k1 + 1) / (tf + norm)
+
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            if not top:
+                return []
+            placeholders = ",".join("?" * len(top))
+            chunk_ids = dict(self.conn.execute(f"SELECT doc_no, chunk_id FROM docs WHERE doc_no IN ({placeholders})",
+                                               [doc_no for doc_no, _ in top]).fetchall())
+        return [(chunk_ids[doc_no], score) for doc_no, score in top]
+
+
+class BM25IndexRetriever(BaseRetriever):
+    """
+    Retriever over a BM25Index that fetches the text of the top hits from the vectorstore.
+    """
+    index: BM25Index
+    vectorstore: VectorStore
+    k: int = 10
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        hits = self.index.search(query, self.k)
+        if not hits:
+            return []
+        ids = [chunk_id for chunk_id, _ in hits]
+        docs = {doc.id: doc for doc in self.vectorstore.get_by_ids(ids)}
+        return [docs[chunk_id] for chunk_id in ids if chunk_id in docs]
@@ -0,0 +1,181 @@
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from typing import Any, AsyncIterator, Iterator, Optional
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from utils import config
+from utils.metrics import metrics
+
+
+class BoundedSqliteSaver(SqliteSaver):
+    """
+    SqliteSaver that keeps only the last `max_checkpoints` checkpoints per thread and namespace,
+    evicts threads idle for longer than `idle_seconds` and records storage size and read/write latency.
+
+    Async methods run the sync implementation in a worker thread, so the saver also serves `astream`.
+    """
+    def __init__(self, path: str, max_checkpoints: int, idle_seconds: float):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        super().__init__(sqlite3.connect(path, check_same_thread=False))
+        self.max_checkpoints = max_checkpoints
+        self.idle_seconds = idle_seconds
+        self.reads, self.read_time = 0, 0.0
+        self.writes, self.write_time = 0, 0.0
+
+    def setup(self):
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.execute("CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+        self.conn.commit()
+
+    def get_tuple(self, config):
+        start = time.perf_counter()
+        try:
+            return super().get_tuple(config)
+        finally:
+            self._record_read(time.perf_counter() - start)
+
+    def list(self, config, *, filter: Optional[dict[str, Any]] = None, before=None, limit: Optional[int] = None) -> Iterator:
+        start = time.perf_counter()
+        try:
+            yield from super().list(config, filter=filter, before=before, limit=limit)
+        finally:
+            self._record_read(time.perf_counter() - start)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        start = time.perf_counter()
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self.cursor() as cur:
+            cur.execute("INSERT OR REPLACE INTO thread_activity (thread_id, last_seen) VALUES (?, ?)",
+                        (thread_id, time.time()))
+            self._prune(cur, thread_id, checkpoint_ns)
+        self._record_write(time.perf_counter() - start)
+        return next_config
+
+    def put_writes(self, config, writes, task_id, *args, **kwargs):
+        start = time.perf_counter()
+        super().put_writes(config, writes, task_id, *args, **kwargs)
+        self._record_write(time.perf_counter() - start)
+
+    def _record_read(self, seconds: float):
+        self.reads += 1
+        self.read_time += seconds
+        metrics.observe("checkpoint_read_seconds", seconds)
+
+    def _record_write(self, seconds: float):
+        self.writes += 1
+        self.write_time += seconds
+        metrics.observe("checkpoint_write_seconds", seconds)
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter: Optional[dict[str, Any]] = None, before=None,
+                    limit: Optional[int] = None) -> AsyncIterator:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, *args, **kwargs):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, *args, **kwargs)
+
+    def _prune(self, cur: sqlite3.Cursor, thread_id: str, checkpoint_ns: str):
+        """
+        Deletes all but the newest `max_checkpoints` checkpoints of a thread namespace and their writes.
+        """
+        cur.execute("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN "
+                    "(SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT ?)",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.max_checkpoints))
+        cur.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN "
+                    "(SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns))
+
+    def evict_idle(self) -> int:
+        """
+        Deletes all checkpoints of threads not written to for `idle_seconds`.
+
+        Returns:
+            int: number of evicted threads.
+        """
+        cutoff = time.time() - self.idle_seconds
+        with self.cursor() as cur:
+            threads = [row[0] for row in cur.execute("SELECT thread_id FROM thread_activity WHERE last_seen < ?",
+                                                     (cutoff,)).fetchall()]
+            for thread_id in threads:
+                cur.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                cur.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (thread_id,))
+        return len(threads)
+
+    def compact(self):
+        """
+        Evicts idle threads, prunes every thread namespace and reclaims free pages.
+        """
+        with metrics.timed("checkpoint_compaction") as fields:
+            evicted = self.evict_idle()
+            with self.cursor() as cur:
+                for thread_id, checkpoint_ns in cur.execute("SELECT DISTINCT thread_id, checkpoint_ns FROM checkpoints").fetchall():
+                    self._prune(cur, thread_id, checkpoint_ns)
+            with self.lock:
+                self.conn.execute("VACUUM")
+            stats = self.stats()
+            fields.update(evicted_threads=evicted, **stats)
+        metrics.inc("checkpoint_evicted_threads_total", evicted)
+        metrics.set("checkpoint_size_bytes", stats["size_bytes"])
+        metrics.set("checkpoint_threads", stats["threads"])
+
+    def start_compaction(self, interval: float):
+        """
+        Runs `compact` every `interval` seconds in a daemon thread.
+        """
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.compact()
+                except Exception as e:
+                    metrics.event("checkpoint_compaction_failed", error=repr(e))
+
+        threading.Thread(target=loop, name="checkpoint-compaction", daemon=True).start()
+
+    def stats(self) -> dict:
+        with self.cursor(transaction=False) as cur:
+            page_count = cur.execute("PRAGMA page_count").fetchone()[0]
+            page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+            threads = cur.execute("SELECT COUNT(*) FROM thread_activity").fetchone()[0]
+        return {
+            "size_bytes": page_count * page_size,
+            "threads": threads,
+            "reads": self.reads,
+            "avg_read_ms": 1000 * self.read_time / self.reads if self.reads else 0.0,
+            "writes": self.writes,
+            "avg_write_ms": 1000 * self.write_time / self.writes if self.writes else 0.0,
+        }
+
+
+def build_checkpointer() -> BaseCheckpointSaver:
+    """
+    Creates the checkpoint backend selected by `config.checkpoint_backend`.
+    """
+    if config.checkpoint_backend == "memory":
+        return MemorySaver()
+    if config.checkpoint_backend == "sqlite":
+        saver = BoundedSqliteSaver(config.checkpoint_path,
+                                   config.checkpoint_max_per_thread,
+                                   config.checkpoint_idle_seconds)
+        saver.start_compaction(config.checkpoint_compaction_interval)
+        return saver
+    raise RuntimeError(f"Unknown checkpoint backend: {config.checkpoint_backend}")
@@ -0,0 +1,125 @@
+from langchain_core.documents import Document
+
+from collections import defaultdict
+from typing import Optional
+
+
+def approx_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def doc_score(doc: Document, rank: int) -> float:
+    """
+    Reranker score if present, otherwise the ensemble fusion score, otherwise the retrieval rank.
+    """
+    if "relevance_score" in doc.metadata:
+        return float(doc.metadata["relevance_score"])
+    if "fusion_score" in doc.metadata:
+        return float(doc.metadata["fusion_score"])
+    return -float(rank)
+
+
+def merge_overlap(a: str, b: str, min_overlap: int = 20, max_overlap: int = 600) -> Optional[str]:
+    """
+    Joins b to a when b is contained in a or starts with a suffix of a.
+
+    Returns:
+        Optional[str]: merged text or None if the texts do not overlap.
+    """
+    if b in a:
+        return a
+    for size in range(min(len(a), len(b), max_overlap), min_overlap - 1, -1):
+        if a.endswith(b[:size]):
+            return a + b[size:]
+    return None
+
+
+def shingles(text: str, n: int = 5) -> set:
+    words = text.lower().split()
+    return {tuple(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+
+class Passage:
+    def __init__(self, text: str, score: float, start: Optional[int] = None):
+        self.text = text
+        self.score = score
+        self.start = start
+
+    @property
+    def end(self) -> Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+
+def merge_group(passages: list[Passage]) -> list[Passage]:
+    """
+    Merges overlapping or directly adjacent passages of one source page. Uses `start_index` offsets when
+    all chunks have them and falls back to matching overlapping text otherwise.
+    """
+    if all(p.start is not None for p in passages):
+        merged = []
+        for p in sorted(passages, key=lambda p: p.start):
+            last = merged[-1] if merged else None
+            # Only chunks touching or overlapping the merged text, a gap would lose the text in between
+            if last is not None and p.start <= last.end:
+                if p.end > last.end:
+                    last.text = last.text + p.text[last.end - p.start:]
+                last.score = max(last.score, p.score)
+            else:
+                merged.append(Passage(p.text, p.score, p.start))
+        return merged
+
+    merged = list(passages)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(len(merged)):
+                if i == j:
+                    continue
+                text = merge_overlap(merged[i].text, merged[j].text)
+                if text is not None:
+                    merged[i] = Passage(text, max(merged[i].score, merged[j].score))
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return merged
+
+
+def pack_context(docs: list[Document], token_budget: int, dedup_threshold: float = 0.8) -> tuple[str, dict]:
+    """
+    Assembles retrieved chunks into a prompt context: merges overlapping chunks of the same source page,
+    drops passages mostly contained in a higher scored one, orders passages by score and packs them into the token budget.
+
+    Returns:
+        tuple[str, dict]: context and token statistics.
+    """
+    groups = defaultdict(list)
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups[key].append(Passage(doc.page_content, doc_score(doc, rank), doc.metadata.get("start_index")))
+
+    passages = [p for group in groups.values() for p in merge_group(group)]
+    passages.sort(key=lambda p: p.score, reverse=True)
+
+    unique, unique_shingles = [], []
+    for p in passages:
+        s = shingles(p.text)
+        # Near-duplicate if most of its shingles already appear in a higher scored passage
+        if any(len(s & other) / max(len(s), 1) >= dedup_threshold for other in unique_shingles):
+            continue
+        unique.append(p)
+        unique_shingles.append(s)
+
+    packed, used = [], 0
+    for p in unique:
+        tokens = approx_tokens(p.text)
+        if used + tokens <= token_budget:
+            packed.append(p.text)
+            used += tokens
+
+    raw = sum(approx_tokens(doc.page_content) for doc in docs)
+    stats = {"chunks": len(docs), "passages": len(packed), "raw_tokens": raw, "packed_tokens": used,
+             "saved_tokens": raw - used}
+    return "\n\n".join(packed), stats
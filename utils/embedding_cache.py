@@ -0,0 +1,179 @@
+from langchain_core.embeddings import Embeddings
+
+import numpy as np
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from utils.metrics import metrics
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    key TEXT PRIMARY KEY,
+    slot INTEGER UNIQUE NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS slots_last_access ON slots (last_access);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Disk-backed cache of the vectors of one embedding model.
+
+    Vectors live in a memory-mapped float32 matrix with `max_entries` rows, the row (slot) of every
+    text hash is kept in SQLite together with its last access time. When the matrix is full the least
+    recently used slots are reused.
+    """
+    def __init__(self, directory: str, max_entries: int):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._matrix = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        if row is not None:
+            self._open_matrix(row[0])
+
+    @classmethod
+    def for_model(cls, directory: str, model: str, max_entries: int) -> "EmbeddingCache":
+        return cls(os.path.join(directory, re.sub(r"[^\w.-]", "_", model)), max_entries)
+
+    def _open_matrix(self, dim: int):
+        """
+        Maps the vector file, resizing it when `max_entries` changed since it was created.
+        """
+        path = os.path.join(self.directory, "vectors.f32")
+        size = self.max_entries * dim * 4
+        with open(path, "ab") as f:
+            if f.tell() != size:
+                f.truncate(size)
+        with self._conn:
+            self._conn.execute("DELETE FROM slots WHERE slot >= ?", (self.max_entries,))
+            self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dim', ?)", (dim,))
+        self._matrix = np.memmap(path, dtype=np.float32, mode="r+", shape=(self.max_entries, dim))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate, "entries": len(self),
+                "size_bytes": self._matrix.nbytes if self._matrix is not None else 0}
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """
+        Looks up vectors by text hash.
+
+        Returns:
+            dict[str, np.ndarray]: vectors of the keys found in the cache.
+        """
+        found = {}
+        with self._lock:
+            if self._matrix is None:
+                self.misses += len(keys)
+                return found
+            unique = list(dict.fromkeys(keys))
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(f"SELECT key, slot FROM slots WHERE key IN ({placeholders})", part).fetchall()
+                for key, slot in rows:
+                    found[key] = np.array(self._matrix[slot])
+                with self._conn:
+                    self._conn.executemany("UPDATE slots SET last_access = ? WHERE key = ?",
+                                           [(time.time(), key) for key, _ in rows])
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, keys: list[str], vectors: list[list[float]]):
+        """
+        Stores vectors by text hash, evicting least recently used entries when the cache is full.
+        """
+        with self._lock:
+            items = dict(zip(keys, vectors))
+            if not items:
+                return
+            if self._matrix is None:
+                self._open_matrix(len(next(iter(items.values()))))
+            items = list(items.items())[-self.max_entries:]
+            with self._conn:
+                placeholders = ",".join("?" * len(items))
+                existing = dict(self._conn.execute(f"SELECT key, slot FROM slots WHERE key IN ({placeholders})",
+                                                   [key for key, _ in items]).fetchall())
+                new_keys = [key for key, _ in items if key not in existing]
+                used = self._conn.execute("SELECT COUNT(*) FROM slots").fetchone()[0]
+                free = list(range(used, min(used + len(new_keys), self.max_entries)))
+                n_evict = len(new_keys) - len(free)
+                if n_evict > 0:
+                    evicted = self._conn.execute(
+                        "SELECT key, slot FROM slots WHERE key NOT IN ({}) ORDER BY last_access LIMIT ?".format(placeholders),
+                        [key for key, _ in items] + [n_evict]).fetchall()
+                    self._conn.executemany("DELETE FROM slots WHERE key = ?", [(key,) for key, _ in evicted])
+                    free.extend(slot for _, slot in evicted)
+                slots = {**existing, **dict(zip(new_keys, free))}
+                now = time.time()
+                self._conn.executemany("INSERT OR REPLACE INTO slots (key, slot, last_access) VALUES (?, ?, ?)",
+                                       [(key, slots[key], now) for key, _ in items])
+                for key, vector in items:
+                    self._matrix[slots[key]] = vector
+            self._matrix.flush()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves document and query vectors from an EmbeddingCache
+    and sends only cache misses to the underlying model.
+    """
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [text_hash(text) for text in texts]
+        cached = self.cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        metrics.inc("embedding_cache_hits_total", len(keys) - len(missing))
+        metrics.inc("embedding_cache_misses_total", len(missing))
+        if missing:
+            start = time.perf_counter()
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            metrics.observe("embedding_seconds", time.perf_counter() - start, kind="documents")
+            self.cache.put_many(list(missing), vectors)
+            cached.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in zip(missing, vectors))
+        return [cached[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        key = "query:" + text_hash(text)
+        cached = self.cache.get_many([key])
+        if key in cached:
+            metrics.inc("embedding_cache_hits_total")
+            return cached[key].tolist()
+        metrics.inc("embedding_cache_misses_total")
+        start = time.perf_counter()
+        vector = self.embeddings.embed_query(text)
+        metrics.observe("embedding_seconds", time.perf_counter() - start, kind="query")
+        self.cache.put_many([key], [vector])
+        return vector
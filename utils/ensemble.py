@@ -0,0 +1,130 @@
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import numpy as np
+
+from utils.metrics import metrics
+
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fusion")
+
+
+def maximal_marginal_relevance(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = 0.5) -> list[int]:
+    """
+    Selects k candidate indices trading off similarity to the query against similarity to already selected ones.
+    """
+    if len(candidates) == 0:
+        return []
+    query = query / (np.linalg.norm(query) or 1.0)
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query_similarity = candidates @ query
+    pairwise = candidates @ candidates.T
+    selected = [int(np.argmax(query_similarity))]
+    redundancy = pairwise[:, selected[0]].copy()
+    while len(selected) < min(k, len(candidates)):
+        scores = lambda_mult * query_similarity - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, pairwise[:, best])
+    return selected
+
+
+def query_vectorstore(vectorstore: VectorStore, embedding: list[float], n: int) -> tuple[list[Document], np.ndarray]:
+    """
+    Runs a single nearest-neighbour query returning documents with their stored embeddings, closest first.
+    """
+    if hasattr(vectorstore, "search_with_embeddings"):
+        return vectorstore.search_with_embeddings(embedding, n)
+    result = vectorstore._collection.query(query_embeddings=[embedding], n_results=n,
+                                           include=["documents", "metadatas", "embeddings"])
+    docs = [Document(id=id_, page_content=text, metadata=metadata or {})
+            for id_, text, metadata in zip(result["ids"][0], result["documents"][0], result["metadatas"][0])]
+    if not docs:
+        return docs, np.empty((0, 0), dtype=np.float32)
+    return docs, np.asarray(result["embeddings"][0], dtype=np.float32).reshape(len(docs), -1)
+
+
+class FusionRetriever(BaseRetriever):
+    """
+    Ensemble of similarity, MMR and BM25 retrieval fused with weighted reciprocal rank fusion.
+
+    The query is embedded once and a single vector query fetches `fetch_k` candidates: the top `k` of them
+    are the similarity results and MMR is computed over all of them with NumPy. The vector branch and
+    BM25 run concurrently, a branch whose weights are all zero is skipped.
+    """
+    vectorstore: VectorStore
+    embeddings: Embeddings
+    bm25_retriever: BaseRetriever
+    weights: list[float] = [0.3, 0.3, 0.4]
+    k: int = 10
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    c: int = 60
+
+    def _vector_search(self, query: str) -> tuple[list[Document], list[Document], dict]:
+        timings = {}
+        start = time.perf_counter()
+        embedding = self.embeddings.embed_query(query)
+        timings["embed"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        candidates, vectors = query_vectorstore(self.vectorstore, embedding, self.fetch_k)
+        timings["similarity"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        selected = maximal_marginal_relevance(np.asarray(embedding, dtype=np.float32), vectors, self.k, self.lambda_mult)
+        timings["mmr"] = time.perf_counter() - start
+        return candidates[:self.k], [candidates[i] for i in selected], timings
+
+    def _bm25_search(self, query: str, run_manager: CallbackManagerForRetrieverRun) -> tuple[list[Document], float]:
+        start = time.perf_counter()
+        docs = self.bm25_retriever.invoke(query, config={"callbacks": run_manager.get_child(tag="bm25")})
+        return docs, time.perf_counter() - start
+
+    def fuse(self, doc_lists: list[list[Document]]) -> list[Document]:
+        """
+        Weighted reciprocal rank fusion, documents are deduplicated by id.
+        """
+        scores = defaultdict(float)
+        docs = {}
+        for doc_list, weight in zip(doc_lists, self.weights):
+            if weight <= 0:
+                continue
+            for rank, doc in enumerate(doc_list, start=1):
+                key = doc.id or doc.page_content
+                scores[key] += weight / (rank + self.c)
+                docs.setdefault(key, doc)
+        fused = []
+        for key in sorted(scores, key=scores.get, reverse=True):
+            doc = docs[key]
+            doc.metadata["fusion_score"] = scores[key]
+            fused.append(doc)
+        return fused
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        similarity_docs, mmr_docs, bm25_docs, timings = [], [], [], {}
+        vector_future = bm25_future = None
+        if self.weights[0] > 0 or self.weights[1] > 0:
+            vector_future = _executor.submit(self._vector_search, query)
+        if self.weights[2] > 0:
+            bm25_future = _executor.submit(self._bm25_search, query, run_manager)
+        if vector_future is not None:
+            similarity_docs, mmr_docs, timings = vector_future.result()
+        if bm25_future is not None:
+            bm25_docs, timings["bm25"] = bm25_future.result()
+
+        start = time.perf_counter()
+        fused = self.fuse([similarity_docs, mmr_docs, bm25_docs])
+        timings["fusion"] = time.perf_counter() - start
+        for stage, seconds in timings.items():
+            metrics.observe("retrieval_stage_seconds", seconds, stage=stage)
+        metrics.event("retrieval", **{f"{stage}_ms": round(1000 * t, 1) for stage, t in timings.items()})
+        return fused
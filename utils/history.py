@@ -0,0 +1,93 @@
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from collections import OrderedDict
+import threading
+
+from utils.metrics import metrics
+from utils.prompts import SUMMARY_PROMPT
+
+
+def count_tokens(messages: list[BaseMessage]) -> int:
+    """
+    Approximate token count of a prompt: ~4 characters per token plus a few tokens of per-message overhead.
+    """
+    return sum(len(str(message.content)) // 4 + 4 for message in messages)
+
+
+def split_turns(messages: list[BaseMessage]) -> list[list[BaseMessage]]:
+    """
+    Splits a conversation into turns, every turn starts with a human message.
+    """
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+class ConversationMemory:
+    """
+    Fits the message history of a thread into a token budget before it is sent to the LLM.
+
+    The last `window_turns` turns are kept (fewer if they do not fit into the budget), tool payloads are
+    truncated in all but the current turn, and older turns are folded into a summary. The summary is
+    cached per thread together with the number of messages it covers and only extended with new messages.
+    """
+    def __init__(self, llm, token_budget: int, window_turns: int, tool_payload_chars: int, max_threads: int = 1024):
+        self.llm = llm
+        self.token_budget = token_budget
+        self.window_turns = window_turns
+        self.tool_payload_chars = tool_payload_chars
+        self.max_threads = max_threads
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def strip_tool_payloads(self, turn: list[BaseMessage]) -> list[BaseMessage]:
+        stripped = []
+        for message in turn:
+            if isinstance(message, ToolMessage) and len(str(message.content)) > self.tool_payload_chars:
+                content = str(message.content)[:self.tool_payload_chars] + " ...[truncated]"
+                message = message.model_copy(update={"content": content, "artifact": None})
+            stripped.append(message)
+        return stripped
+
+    def summarize(self, summary: str, messages: list[BaseMessage]) -> str:
+        conversation = "\n".join(f"{message.type}: {message.content}" for message in messages)
+        response = self.llm.invoke(SUMMARY_PROMPT.format(summary=summary or "(empty)", conversation=conversation))
+        return response.content
+
+    def prepare(self, messages: list[BaseMessage], thread_id: str) -> list[BaseMessage]:
+        """
+        Returns the messages to send: an optional summary system message followed by the recent turns.
+        """
+        turns = split_turns(messages)
+        with self._lock:
+            covered, summary = self._summaries.get(thread_id, (0, ""))
+
+        # Turns already folded into the summary are never sent again
+        offsets, offset = [], 0
+        for turn in turns:
+            offsets.append(offset)
+            offset += len(turn)
+        first = next((i for i, o in enumerate(offsets) if o >= covered), len(turns))
+        first = max(first, len(turns) - self.window_turns)
+        recent = [self.strip_tool_payloads(turn) for turn in turns[first:-1]] + turns[-1:]
+        while len(recent) > 1 and count_tokens([m for turn in recent for m in turn]) > self.token_budget:
+            recent.pop(0)
+            first += 1
+
+        boundary = offsets[first] if first < len(turns) else offset
+        if boundary > covered:
+            with metrics.timed("memory_summarize", messages=boundary - covered):
+                summary = self.summarize(summary, self.strip_tool_payloads(messages[covered:boundary]))
+            with self._lock:
+                self._summaries[thread_id] = (boundary, summary)
+                self._summaries.move_to_end(thread_id)
+                while len(self._summaries) > self.max_threads:
+                    self._summaries.popitem(last=False)
+
+        prepared = [m for turn in recent for m in turn]
+        if summary:
+            prepared = [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + prepared
+        return prepared
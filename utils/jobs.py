@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from typing import Callable, Optional
+import itertools
+import queue
+import threading
+import time
+
+from utils.metrics import metrics
+
+
+class IngestJob:
+    """
+    Ingestion of one batch of uploaded files and its progress.
+    """
+    def __init__(self, id_: str, paths: list[str], keys: list[str]):
+        self.id = id_
+        self.paths = paths
+        self.keys = keys
+        self.status = "queued"
+        self.files = 0
+        self.pages = 0
+        self.chunks = 0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def update(self, progress: dict):
+        self.files, self.pages, self.chunks = progress["files"], progress["pages"], progress["chunks"]
+
+    def summary(self) -> str:
+        text = f"Job {self.id}: {self.status}, {self.files}/{len(self.paths)} files, {self.pages} pages, {self.chunks} chunks embedded"
+        if self.finished is not None and self.started is not None:
+            text += f" in {self.finished - self.started:.1f}s"
+        if self.error is not None:
+            text += f" ({self.error})"
+        return text
+
+
+class JobQueue:
+    """
+    Runs ingestion jobs in `workers` background threads, so uploads return right away and at most
+    `workers` jobs are ingested at the same time. The last `max_jobs` jobs are kept for status queries.
+
+    `run(job)` does the work and reports progress through `job.update`, `on_done(job)` is called
+    after every successful job.
+    """
+    def __init__(self, run: Callable[[IngestJob], None], workers: int = 1,
+                 on_done: Optional[Callable[[IngestJob], None]] = None, max_jobs: int = 100):
+        self.run = run
+        self.on_done = on_done
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        for i in range(max(workers, 1)):
+            threading.Thread(target=self._work, name=f"ingest-{i}", daemon=True).start()
+
+    def submit(self, paths: list[str], keys: list[str]) -> IngestJob:
+        with self._lock:
+            job = IngestJob(str(next(self._ids)), paths, keys)
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                oldest = next(iter(self.jobs.values()))
+                if not oldest.done:
+                    break
+                self.jobs.popitem(last=False)
+        self._queue.put(job)
+        metrics.inc("ingest_jobs_total", status="queued")
+        metrics.event("ingest_job_queued", job=job.id, files=len(paths))
+        return job
+
+    def get(self, id_: str) -> Optional[IngestJob]:
+        return self.jobs.get(id_)
+
+    def active(self) -> list[IngestJob]:
+        with self._lock:
+            return [job for job in self.jobs.values() if not job.done]
+
+    def recent(self, n: int = 5) -> list[IngestJob]:
+        with self._lock:
+            return list(self.jobs.values())[-n:]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status, job.started = "running", time.time()
+            try:
+                self.run(job)
+                if self.on_done is not None:
+                    self.on_done(job)
+                job.status = "done"
+            except Exception as e:
+                job.status, job.error = "failed", repr(e)
+            finally:
+                job.finished = time.time()
+                metrics.inc("ingest_jobs_total", status=job.status)
+                metrics.observe("ingest_job_seconds", job.finished - job.started)
+                metrics.event("ingest_job_finished", job=job.id, status=job.status, files=job.files,
+                              pages=job.pages, chunks=job.chunks, error=job.error)
+                self._queue.task_done()
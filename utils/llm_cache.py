@@ -0,0 +1,121 @@
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.language_models import BaseChatModel
+from langchain_core.load import dumps, loads
+
+from typing import Any, Optional
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils import config
+from utils.metrics import metrics
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    generations TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+CREATE INDEX IF NOT EXISTS responses_created ON responses (created);
+"""
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """
+    `llm_string` holds the model, its parameters and the bound tools or structured output schema,
+    `prompt` the serialized messages.
+    """
+    return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    Persistent exact-match cache of LLM responses, meant for deterministic (temperature 0) calls.
+
+    Entries older than `ttl` seconds are ignored and purged, the least recently used ones are
+    evicted when there are more than `max_entries`.
+    """
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = cache_key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute("SELECT generations, created FROM responses WHERE key = ?", (key,)).fetchone()
+            generations = None
+            if row is not None and time.time() - row[1] <= self.ttl:
+                try:
+                    generations = [loads(generation) for generation in json.loads(row[0])]
+                except Exception:
+                    generations = None
+            if generations is None:
+                self.misses += 1
+                metrics.inc("llm_cache_misses_total")
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        metrics.inc("llm_cache_hits_total")
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE):
+        payload = json.dumps([dumps(generation) for generation in return_val])
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, generations, created, last_access) "
+                               "VALUES (?, ?, ?, ?)", (cache_key(prompt, llm_string), payload, now, now))
+            self._evict()
+
+    def _evict(self):
+        """
+        Drops expired entries, then the least recently used ones above `max_entries`.
+        """
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        excess = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute("DELETE FROM responses WHERE key IN "
+                               "(SELECT key FROM responses ORDER BY last_access LIMIT ?)", (excess,))
+            metrics.inc("llm_cache_evictions_total", excess)
+
+    def clear(self, **kwargs: Any):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+
+def uncached(llm: Any) -> Any:
+    """
+    Copy of a chat model that bypasses the response cache. Used for generations streamed to the UI,
+    where a cache hit would arrive as a single chunk instead of a token stream, and for calls made
+    for their side effect on Ollama such as loading the model.
+    """
+    if isinstance(llm, BaseChatModel):
+        return llm.model_copy(update={"cache": False})
+    return llm
+
+
+def build_llm_cache() -> Optional[SQLiteLLMCache]:
+    """
+    Creates the LLM response cache when `config.llm_cache` is set.
+    """
+    if not config.llm_cache:
+        return None
+    return SQLiteLLMCache(config.llm_cache_path, config.llm_cache_ttl, config.llm_cache_max_entries)
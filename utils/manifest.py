@@ -0,0 +1,102 @@
+from langchain_core.documents import Document
+
+from typing import Optional
+import hashlib
+import json
+import os
+import threading
+
+
+UPLOADS_PREFIX = "uploads/"
+
+
+def file_hash(path: str) -> str:
+    """
+    Returns sha256 hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def upload_key(path: str, hash_: str) -> str:
+    """
+    Manifest key of an uploaded file. Includes the content hash, so a different file uploaded
+    under the same name does not replace the earlier one.
+    """
+    return f"{UPLOADS_PREFIX}{hash_[:16]}/{os.path.basename(path)}"
+
+
+def chunk_id(key: str, doc: Document) -> str:
+    """
+    Deterministic vectorstore id of a chunk, derived from its source key, page and content.
+    """
+    page = doc.metadata.get("page", "")
+    return hashlib.sha256(f"{key}\0{page}\0{doc.page_content}".encode("utf-8")).hexdigest()
+
+
+class IngestionManifest:
+    """
+    Persistent record of ingested files.
+
+    Every entry is keyed by the file path relative to the working directory (or `uploads/<hash>/<name>`
+    for uploaded files) and stores the file hash, size, mtime and ids of its chunks in the vectorstore.
+    Safe to update from concurrent ingestion jobs.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self.exists = os.path.exists(path)
+        self.files = {}
+        if self.exists:
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f)["files"]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"files": self.files}, f)
+            os.replace(tmp_path, self.path)
+            self.exists = True
+
+    def is_unchanged(self, key: str, path: str) -> bool:
+        """
+        Checks whether the file was ingested with the same content. Size and mtime are compared
+        first so unchanged files are not re-hashed on every startup.
+        """
+        entry = self.files.get(key)
+        if entry is None:
+            return False
+        stat = os.stat(path)
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return True
+        if entry["hash"] != file_hash(path):
+            return False
+        entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+        return True
+
+    def find_hash(self, hash_: str) -> Optional[str]:
+        """
+        Returns the key of an ingested file with the given content hash.
+        """
+        with self._lock:
+            for key, entry in self.files.items():
+                if entry["hash"] == hash_:
+                    return key
+        return None
+
+    def chunks(self, key: str) -> list[str]:
+        return self.files.get(key, {}).get("chunks", [])
+
+    def set(self, key: str, path: str, hash_: str, chunks: list[str]):
+        stat = os.stat(path)
+        with self._lock:
+            self.files[key] = {"hash": hash_, "size": stat.st_size, "mtime": stat.st_mtime, "chunks": chunks}
+
+    def remove(self, key: str):
+        with self._lock:
+            self.files.pop(key, None)
@@ -0,0 +1,236 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, Optional
+import bisect
+import json
+import os
+import threading
+import time
+
+from utils import config
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def format_labels(key: tuple, extra: Optional[tuple] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Structured events, counters, gauges and latency histograms of the application.
+
+    Every event is printed (when `console` is set) and appended as a JSON line to the trace file
+    (when `trace_path` is set). Counters, gauges and histograms are exported in the Prometheus text format.
+    """
+    def __init__(self, console: bool = True, trace_path: str = ""):
+        self.console = console
+        self.trace_path = trace_path
+        self.counters = defaultdict(float)
+        self.histograms = defaultdict(Histogram)
+        self.gauges = {}
+        self._trace = None
+        if trace_path:
+            os.makedirs(os.path.dirname(trace_path) or ".", exist_ok=True)
+            self._trace = open(trace_path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def event(self, name: str, **fields: Any):
+        if self.console:
+            details = ", ".join(f"{k}={v}" for k, v in fields.items())
+            print(f"---{name.upper().replace('_', ' ')}" + (f": {details}" if details else "") + "---")
+        if self._trace is not None:
+            line = json.dumps({"ts": time.time(), "event": name, **fields}, default=str)
+            with self._lock:
+                self._trace.write(line + "\n")
+
+    def inc(self, name: str, value: float = 1, **labels: Any):
+        with self._lock:
+            self.counters[(name, label_key(labels))] += value
+
+    def set(self, name: str, value: float, **labels: Any):
+        with self._lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name: str, seconds: float, **labels: Any):
+        with self._lock:
+            self.histograms[(name, label_key(labels))].observe(seconds)
+
+    @contextmanager
+    def timed(self, name: str, **labels: Any) -> Iterator[dict]:
+        """
+        Times a block (or a function, used as a decorator) into the `<name>_seconds` histogram and emits
+        a `<name>` event with the duration. Fields added to the yielded dict are included in the event,
+        failures are counted in `<name>_errors_total`.
+        """
+        fields = {}
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException:
+            self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(f"{name}_seconds", seconds, **labels)
+            self.event(name, **labels, **fields, duration_ms=round(1000 * seconds, 1))
+
+    def prometheus(self) -> str:
+        """
+        Counters, gauges and histograms in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            typed = set()
+            for (name, key), value in counters:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{format_labels(key)} {value}")
+            for (name, key), value in gauges:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} gauge")
+                    typed.add(name)
+                lines.append(f"{name}{format_labels(key)} {value}")
+            for (name, key), histogram in histograms:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append(f"{name}_bucket{format_labels(key, ('le', le))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port: int):
+        """
+        Serves the Prometheus metrics on `http://0.0.0.0:<port>/metrics` from a daemon thread.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        self.event("metrics_server_started", port=port)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records latency of graph nodes, tools and LLM calls and the token usage of LLM calls.
+    Attached to the LLM and passed with the graph config, it is inherited by nested graphs and tools.
+    """
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self._starts = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, kind: str, name: str):
+        with self._lock:
+            self._starts[run_id] = (kind, name, time.perf_counter())
+
+    def _end(self, run_id, error: bool = False, **fields: Any):
+        with self._lock:
+            item = self._starts.pop(run_id, None)
+        if item is None:
+            return
+        kind, name, start = item
+        seconds = time.perf_counter() - start
+        self.metrics.observe(f"{kind}_seconds", seconds, **{kind: name})
+        if error:
+            self.metrics.inc(f"{kind}_errors_total", **{kind: name})
+        self.metrics.event(kind, **{kind: name}, **fields, duration_ms=round(1000 * seconds, 1))
+
+    def on_chain_start(self, serialized: Optional[dict], inputs: Any, *, run_id, metadata: Optional[dict] = None,
+                       **kwargs: Any):
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and kwargs.get("name") == node:
+            self._start(run_id, "node", node)
+
+    def on_chain_end(self, outputs: Any, *, run_id, **kwargs: Any):
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id, **kwargs: Any):
+        self._end(run_id, error=True)
+
+    def on_tool_start(self, serialized: Optional[dict], input_str: str, *, run_id, **kwargs: Any):
+        self._start(run_id, "tool", kwargs.get("name") or (serialized or {}).get("name", ""))
+
+    def on_tool_end(self, output: Any, *, run_id, **kwargs: Any):
+        self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id, **kwargs: Any):
+        self._end(run_id, error=True)
+
+    def on_chat_model_start(self, serialized: Optional[dict], messages: Any, *, run_id, **kwargs: Any):
+        model = (kwargs.get("invocation_params") or {}).get("model") or config.llm
+        self._start(run_id, "llm", model)
+
+    def on_llm_start(self, serialized: Optional[dict], prompts: Any, *, run_id, **kwargs: Any):
+        model = (kwargs.get("invocation_params") or {}).get("model") or config.llm
+        self._start(run_id, "llm", model)
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs: Any):
+        with self._lock:
+            item = self._starts.get(run_id)
+        model = item[1] if item else config.llm
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        self.metrics.inc("llm_input_tokens_total", input_tokens, llm=model)
+        self.metrics.inc("llm_output_tokens_total", output_tokens, llm=model)
+        self._end(run_id, input_tokens=input_tokens, output_tokens=output_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs: Any):
+        self._end(run_id, error=True)
+
+
+metrics = Metrics(config.metrics_console, config.metrics_trace_path)
+metrics_callback = MetricsCallbackHandler(metrics)
@@ -0,0 +1,292 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from typing import Any, Iterable, Optional, Sequence
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+import numpy as np
+
+from utils.ensemble import maximal_marginal_relevance
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    row INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    document TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+QUANTIZATION_DTYPES = {"none": None, "float16": np.float16, "int8": np.int8}
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process vector store keeping normalized embeddings in memory-mapped NumPy matrices and
+    texts and metadata in SQLite. Search is an exact, blocked dot product (cosine similarity).
+
+    With `quantization` "float16" or "int8" (per-row scale) candidates are searched in the quantized
+    matrix and the best `rescore_factor` * k of them are rescored with the float32 vectors, which are
+    only paged in for those rows. Rows of deleted documents are reused by later additions.
+    """
+    def __init__(self, directory: str, embedding: Embeddings, quantization: str = "none",
+                 rescore_factor: int = 4, block_rows: int = 65536):
+        if quantization not in QUANTIZATION_DTYPES:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.directory = directory
+        self.embedding = embedding
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.block_rows = block_rows
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "docs.sqlite"), check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._vectors = self._quantized = self._scales = None
+        self._dim, self._capacity = 0, 0
+        meta = dict(self._conn.execute("SELECT name, value FROM meta").fetchall())
+        if "dim" in meta:
+            if meta.get("quantization", "none") != quantization:
+                raise RuntimeError(f"Store in {directory} was built with {meta.get('quantization')} quantization, "
+                                   f"reindex it to use {quantization}")
+            self._open(int(meta["dim"]), int(meta["capacity"]))
+        rows = [row for (row,) in self._conn.execute("SELECT row FROM docs")]
+        self._rows = int(meta.get("rows", 0))
+        self._alive = np.zeros(max(self._capacity, 1), dtype=bool)
+        self._alive[rows] = True
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def _open(self, dim: int, capacity: int):
+        """
+        Maps the vector files with room for `capacity` rows, growing them when needed.
+        """
+        def mapped(name: str, dtype, shape: tuple):
+            path = os.path.join(self.directory, name)
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+            return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+        self._vectors = mapped("vectors.f32", np.float32, (capacity, dim))
+        dtype = QUANTIZATION_DTYPES[self.quantization]
+        if dtype is not None:
+            self._quantized = mapped(f"vectors.{self.quantization}", dtype, (capacity, dim))
+            self._scales = mapped("scales.f32", np.float32, (capacity,))
+        self._dim, self._capacity = dim, capacity
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                                   [("dim", str(dim)), ("capacity", str(capacity)),
+                                    ("quantization", self.quantization)])
+
+    def _reserve(self, n: int, dim: int) -> list[int]:
+        """
+        Returns `n` free rows, reusing rows of deleted documents first.
+        """
+        if self._vectors is None:
+            self._open(dim, max(1024, n))
+        elif dim != self._dim:
+            raise ValueError(f"Embedding dimension {dim} does not match the store dimension {self._dim}")
+        free = np.flatnonzero(~self._alive[:self._rows])[:n].tolist()
+        new = n - len(free)
+        if self._rows + new > self._capacity:
+            self._open(self._dim, max(2 * self._capacity, self._rows + new))
+        if len(self._alive) < self._capacity:
+            self._alive = np.concatenate([self._alive, np.zeros(self._capacity - len(self._alive), dtype=bool)])
+        rows = free + list(range(self._rows, self._rows + new))
+        self._rows += new
+        return rows
+
+    def _write(self, rows: list[int], vectors: np.ndarray):
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self._vectors[rows] = vectors
+        if self.quantization == "float16":
+            self._quantized[rows] = vectors.astype(np.float16)
+            self._scales[rows] = 1.0
+        elif self.quantization == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            self._quantized[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self._scales[rows] = scales
+        for matrix in (self._vectors, self._quantized, self._scales):
+            if matrix is not None:
+                matrix.flush()
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[list[dict]] = None, *,
+                  ids: Optional[list[str]] = None, **kwargs: Any) -> list[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = [id_ or str(uuid.uuid4()) for id_ in (ids or [None] * len(texts))]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.asarray(self.embedding.embed_documents(texts), dtype=np.float32)
+        with self._lock, self._conn:
+            # Re-adding an id replaces the document
+            self._delete(ids)
+            rows = self._reserve(len(texts), vectors.shape[1])
+            self._write(rows, vectors)
+            self._conn.executemany("INSERT INTO docs (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                                   [(row, id_, text, json.dumps(metadata))
+                                    for row, id_, text, metadata in zip(rows, ids, texts, metadatas)])
+            self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('rows', ?)", (str(self._rows),))
+            self._alive[rows] = True
+        return ids
+
+    def _delete(self, ids: Sequence[str]):
+        for i in range(0, len(ids), 500):
+            part = list(ids[i:i + 500])
+            placeholders = ",".join("?" * len(part))
+            rows = [row for (row,) in self._conn.execute(f"SELECT row FROM docs WHERE id IN ({placeholders})", part)]
+            self._conn.execute(f"DELETE FROM docs WHERE id IN ({placeholders})", part)
+            self._alive[rows] = False
+
+    def delete(self, ids: Optional[list[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return None
+        with self._lock, self._conn:
+            self._delete(ids)
+        return True
+
+    def _documents(self, rows: list[int]) -> dict[int, Document]:
+        docs = {}
+        for i in range(0, len(rows), 500):
+            part = rows[i:i + 500]
+            placeholders = ",".join("?" * len(part))
+            for row, id_, text, metadata in self._conn.execute(
+                    f"SELECT row, id, document, metadata FROM docs WHERE row IN ({placeholders})", part):
+                docs[row] = Document(id=id_, page_content=text, metadata=json.loads(metadata))
+        return docs
+
+    def get_by_ids(self, ids: Sequence[str], /) -> list[Document]:
+        with self._lock:
+            docs = {}
+            for i in range(0, len(ids), 500):
+                part = list(ids[i:i + 500])
+                placeholders = ",".join("?" * len(part))
+                for id_, text, metadata in self._conn.execute(
+                        f"SELECT id, document, metadata FROM docs WHERE id IN ({placeholders})", part):
+                    docs[id_] = Document(id=id_, page_content=text, metadata=json.loads(metadata))
+        return [docs[id_] for id_ in ids if id_ in docs]
+
+    def get(self, ids: Optional[list[str]] = None, limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Sequence[str] = ("documents", "metadatas")) -> dict:
+        """
+        Chroma-compatible listing of stored documents in insertion row order.
+        """
+        query, params = "SELECT id, document, metadata FROM docs", []
+        if ids is not None:
+            query += f" WHERE id IN ({','.join('?' * len(ids))})"
+            params.extend(ids)
+        query += " ORDER BY row LIMIT ? OFFSET ?"
+        params.extend([-1 if limit is None else limit, offset or 0])
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        result = {"ids": [id_ for id_, _, _ in rows]}
+        if "documents" in include:
+            result["documents"] = [text for _, text, _ in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(metadata) for _, _, metadata in rows]
+        return result
+
+    def search_vectors(self, queries: np.ndarray, n: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Exact top-n search of a batch of query vectors, blockwise over the (quantized) matrix and
+        rescored in float32 when quantized.
+
+        Returns:
+            list[tuple[np.ndarray, np.ndarray]]: rows and cosine similarities per query, best first.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self._dim or queries.shape[-1])
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            if self._vectors is None or not self._alive[:self._rows].any():
+                return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+            matrix = self._vectors if self._quantized is None else self._quantized
+            n_candidates = n if self._quantized is None else n * self.rescore_factor
+            best_rows = np.empty((len(queries), 0), dtype=np.int64)
+            best_scores = np.empty((len(queries), 0), dtype=np.float32)
+            for start in range(0, self._rows, self.block_rows):
+                stop = min(start + self.block_rows, self._rows)
+                scores = np.asarray(matrix[start:stop], dtype=np.float32) @ queries.T
+                if self._scales is not None:
+                    scores *= np.asarray(self._scales[start:stop])[:, None]
+                scores[~self._alive[start:stop]] = -np.inf
+                scores = scores.T
+                rows = np.broadcast_to(np.arange(start, stop), scores.shape)
+                best_rows = np.concatenate([best_rows, rows], axis=1)
+                best_scores = np.concatenate([best_scores, scores], axis=1)
+                if best_scores.shape[1] > n_candidates:
+                    top = np.argpartition(-best_scores, n_candidates - 1, axis=1)[:, :n_candidates]
+                    best_rows = np.take_along_axis(best_rows, top, axis=1)
+                    best_scores = np.take_along_axis(best_scores, top, axis=1)
+
+            results = []
+            for rows, scores in zip(best_rows, best_scores):
+                rows = rows[np.isfinite(scores)]
+                if self._quantized is not None and len(rows):
+                    order = np.argsort(rows)
+                    exact = np.asarray(self._vectors[rows[order]]) @ queries[len(results)]
+                    rows, scores = rows[order], exact
+                else:
+                    scores = scores[np.isfinite(scores)]
+                top = np.argsort(-scores, kind="stable")[:n]
+                results.append((rows[top], scores[top].astype(np.float32)))
+        return results
+
+    def search_with_embeddings(self, embedding: list[float], n: int) -> tuple[list[Document], np.ndarray]:
+        """
+        Nearest neighbours of one query vector with their stored (normalized) embeddings, closest first.
+        """
+        rows, _ = self.search_vectors(np.asarray([embedding], dtype=np.float32), n)[0]
+        with self._lock:
+            docs = self._documents(rows.tolist())
+            vectors = np.asarray(self._vectors[rows]) if len(rows) else np.empty((0, self._dim), dtype=np.float32)
+        return [docs[row] for row in rows.tolist()], vectors
+
+    def similarity_search_with_score_by_vector(self, embedding: list[float], k: int = 4) -> list[tuple[Document, float]]:
+        rows, scores = self.search_vectors(np.asarray([embedding], dtype=np.float32), k)[0]
+        with self._lock:
+            docs = self._documents(rows.tolist())
+        return [(docs[row], float(score)) for row, score in zip(rows.tolist(), scores)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> list[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def max_marginal_relevance_search_by_vector(self, embedding: list[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, **kwargs: Any) -> list[Document]:
+        docs, vectors = self.search_with_embeddings(embedding, fetch_k)
+        selected = maximal_marginal_relevance(np.asarray(embedding, dtype=np.float32), vectors, k, lambda_mult)
+        return [docs[i] for i in selected]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5, **kwargs: Any) -> list[Document]:
+        return self.max_marginal_relevance_search_by_vector(self.embedding.embed_query(query), k, fetch_k,
+                                                            lambda_mult)
+
+    @classmethod
+    def from_texts(cls, texts: list[str], embedding: Embeddings, metadatas: Optional[list[dict]] = None, *,
+                   ids: Optional[list[str]] = None, directory: str = "numpy_store", **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -109,4 +109,15 @@ Generate a list of search queries that will gather any relevant information. Onl
 ROUTER_PROMPT = """Determine if the user query requires a simple, advanced or . An 'advanced' request might require \
 multiple steps like retrieving an order ID and looking up shipping information, whereas a 'simple' request can \
 handle more straightforward queries. return either 'simple' or 'advanced'. Do not explain your reasoning Your \
-only task is to determine where to route the user query."""
\ No newline at end of file
+only task is to determine where to route the user query."""
+
+SUMMARY_PROMPT = """You are maintaining a running summary of a conversation between a user and an AI assistant.
+
+Current summary:
+{summary}
+
+New lines of the conversation:
+{conversation}
+
+Extend the current summary with the new lines. Keep facts, names, user preferences and open questions, \
+drop small talk. Return only the updated summary, at most 200 words."""
@@ -0,0 +1,136 @@
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from functools import lru_cache
+from typing import Optional, Sequence
+import os
+import sqlite3
+import threading
+import time
+
+from utils.embedding_cache import text_hash
+from utils.runtime import runtime_option
+from utils.metrics import metrics
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    model TEXT NOT NULL,
+    query_hash TEXT NOT NULL,
+    chunk_hash TEXT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (model, query_hash, chunk_hash)
+);
+"""
+
+
+@lru_cache(maxsize=None)
+def load_cross_encoder(model_name: str, max_length: int, num_threads: int = 0):
+    """
+    Loads a sentence-transformers CrossEncoder once per process.
+    """
+    from sentence_transformers import CrossEncoder
+
+    if num_threads > 0:
+        import torch
+        torch.set_num_threads(num_threads)
+    with metrics.timed("load_cross_encoder", model=model_name):
+        return CrossEncoder(model_name, max_length=max_length)
+
+
+class ScoreCache:
+    """
+    Persistent cache of cross-encoder scores keyed by (model, query hash, chunk hash).
+    """
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def get_many(self, model: str, query_hash: str, chunk_hashes: list[str]) -> dict[str, float]:
+        if not chunk_hashes:
+            return {}
+        placeholders = ",".join("?" * len(chunk_hashes))
+        with self._lock:
+            rows = self._conn.execute(f"SELECT chunk_hash, score FROM scores WHERE model = ? AND query_hash = ? "
+                                      f"AND chunk_hash IN ({placeholders})",
+                                      [model, query_hash, *chunk_hashes]).fetchall()
+        return dict(rows)
+
+    def put_many(self, model: str, query_hash: str, scores: dict[str, float]):
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO scores (model, query_hash, chunk_hash, score) "
+                                   "VALUES (?, ?, ?, ?)",
+                                   [(model, query_hash, chunk_hash, score) for chunk_hash, score in scores.items()])
+
+
+class BatchedCrossEncoderReranker(BaseDocumentCompressor):
+    """
+    Cross-encoder reranker that scores at most `max_candidates` documents in batches of `batch_size`,
+    truncating pairs to `max_length` tokens. Scores are cached per (query, chunk), so repeated
+    queries only run the model for new chunks.
+    """
+    model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    top_n: int = 5
+    max_candidates: int = 20
+    batch_size: int = 16
+    max_length: int = 512
+    num_threads: int = 0
+    cache: Optional[ScoreCache] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def score(self, query: str, documents: list[Document]) -> list[float]:
+        query_hash = text_hash(query)
+        chunk_hashes = [text_hash(doc.page_content) for doc in documents]
+        scores = self.cache.get_many(self.model_name, query_hash, chunk_hashes) if self.cache else {}
+        missing = list(dict.fromkeys(h for h in chunk_hashes if h not in scores))
+        metrics.inc("rerank_cache_hits_total", len(chunk_hashes) - len(missing))
+        metrics.inc("rerank_cache_misses_total", len(missing))
+        if missing:
+            texts = {h: doc.page_content for h, doc in zip(chunk_hashes, documents)}
+            model = load_cross_encoder(self.model_name, self.max_length, self.num_threads)
+            predicted = model.predict([(query, texts[h]) for h in missing],
+                                      batch_size=self.batch_size,
+                                      show_progress_bar=False)
+            new_scores = {h: float(s) for h, s in zip(missing, predicted)}
+            if self.cache:
+                self.cache.put_many(self.model_name, query_hash, new_scores)
+            scores.update(new_scores)
+        return [scores[h] for h in chunk_hashes]
+
+    def compress_documents(self, documents: Sequence[Document], query: str,
+                           callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        start = time.perf_counter()
+        candidates = list(documents)[:self.max_candidates]
+        if not candidates:
+            return []
+        scores = self.score(query, candidates)
+        ranked = sorted(zip(candidates, scores), key=lambda item: item[1], reverse=True)[:self.top_n]
+        result = []
+        for doc, score in ranked:
+            doc.metadata["relevance_score"] = score
+            result.append(doc)
+        seconds = time.perf_counter() - start
+        metrics.observe("rerank_seconds", seconds)
+        metrics.event("reranked", candidates=len(candidates), duration_ms=round(1000 * seconds, 1))
+        return result
+
+
+class RuntimeRerankRetriever(BaseRetriever):
+    """
+    Reranks the results of the base retriever when the `reranking` runtime option of the current run is on,
+    keeping `top_k` documents. Otherwise the base results are returned unchanged.
+    """
+    base_retriever: BaseRetriever
+    reranker: BatchedCrossEncoderReranker
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        docs = self.base_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        if not runtime_option("reranking"):
+            return docs
+        reranker = self.reranker.model_copy(update={"top_n": runtime_option("top_k")})
+        return list(reranker.compress_documents(docs, query, callbacks=run_manager.get_child()))
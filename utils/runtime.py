@@ -0,0 +1,88 @@
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import ensure_config
+from pydantic import ConfigDict
+
+from typing import Any, Optional
+import threading
+
+from utils import config
+from utils.metrics import metrics
+
+
+# Options that can be changed per request through the `configurable` section of the graph config
+RUNTIME_OPTIONS = ("top_k", "reranking", "hallucinations")
+
+
+def runtime_option(name: str) -> Any:
+    """
+    Reads a runtime option from the config of the current run, falling back to the global settings.
+    Works anywhere inside a graph run: nodes, tools and retrievers invoked from them.
+    """
+    configurable = ensure_config().get("configurable", {})
+    return configurable.get(name, getattr(config, name))
+
+
+def runtime_options(top_k: int, reranking: bool, hallucinations: bool) -> dict:
+    return {"top_k": top_k, "reranking": reranking, "hallucinations": hallucinations}
+
+
+class RetrieverHandle:
+    """
+    Holds the current retriever. Compiled graphs keep the handle, so a rebuilt retriever is
+    put in place by `swap` without recompiling them. Runs in flight finish with the retriever they started with.
+
+    A handle created without a retriever blocks readers until the first `swap`, so the UI can start
+    serving while the index is warmed up in the background.
+    """
+    def __init__(self, retriever: Optional[BaseRetriever] = None):
+        self._retriever = retriever
+        self._error = None
+        self._ready = threading.Event()
+        if retriever is not None:
+            self._ready.set()
+        self._lock = threading.Lock()
+        self.version = 0
+
+    @property
+    def current(self) -> BaseRetriever:
+        if not self._ready.is_set():
+            metrics.inc("retriever_warmup_waits_total")
+            metrics.event("waiting_for_retriever_warmup")
+            self._ready.wait()
+        if self._retriever is None:
+            raise RuntimeError(f"Retriever is not available: {self._error}")
+        return self._retriever
+
+    def swap(self, retriever: BaseRetriever) -> Optional[BaseRetriever]:
+        """
+        Replaces the retriever and returns the previous one.
+        """
+        with self._lock:
+            previous, self._retriever = self._retriever, retriever
+            self.version += 1
+            self._ready.set()
+        metrics.inc("retriever_swaps_total")
+        metrics.event("retriever_swapped", version=self.version)
+        return previous
+
+    def fail(self, error: Exception):
+        """
+        Releases waiting readers with an error when the first retriever could not be built.
+        """
+        with self._lock:
+            self._error = error
+            self._ready.set()
+
+
+class HandleRetriever(BaseRetriever):
+    """
+    Retriever delegating to the current retriever of a RetrieverHandle.
+    """
+    handle: RetrieverHandle
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        return self.handle.current.invoke(query, config={"callbacks": run_manager.get_child()})
@@ -0,0 +1,97 @@
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+import itertools
+import threading
+import time
+
+import numpy as np
+
+from utils.metrics import metrics
+
+
+class SemanticCache:
+    """
+    In-memory cache of ranked retrieval results, matched by cosine similarity of query embeddings.
+
+    Entries are only reused for the same retrieval settings, expire after `ttl` seconds and
+    the least recently used entry is dropped when `max_entries` is exceeded.
+    """
+    def __init__(self, threshold: float, max_entries: int, ttl: float):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def lookup(self, vector: list[float], settings: Hashable) -> Optional[list[Document]]:
+        """
+        Returns cached documents of the most similar cached query above the threshold.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._lock:
+            now = time.time()
+            for entry_id in [i for i, (_, _, _, created) in self._entries.items() if now - created > self.ttl]:
+                del self._entries[entry_id]
+            candidates = [(i, v) for i, (s, v, _, _) in self._entries.items() if s == settings]
+            if candidates:
+                similarities = np.stack([v for _, v in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id = candidates[best][0]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return self._entries[entry_id][2]
+            self.misses += 1
+        return None
+
+    def store(self, vector: list[float], settings: Hashable, docs: list[Document], generation: int):
+        """
+        Caches documents retrieved for the query. Results computed before the last invalidation are dropped.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[next(self._ids)] = (settings, query, docs, time.time())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+class SemanticCacheRetriever(BaseRetriever):
+    """
+    Retriever wrapper that serves results of semantically close earlier queries from a SemanticCache.
+    """
+    retriever: BaseRetriever
+    cache: SemanticCache
+    embeddings: Embeddings
+    settings: Callable[[], Hashable]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        settings = self.settings()
+        generation = self.cache.generation
+        vector = self.embeddings.embed_query(query)
+        docs = self.cache.lookup(vector, settings)
+        if docs is not None:
+            metrics.inc("semantic_cache_hits_total")
+            metrics.event("semantic_cache_hit")
+            return docs
+        metrics.inc("semantic_cache_misses_total")
+        docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        self.cache.store(vector, settings, docs, generation)
+        return docs
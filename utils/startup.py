@@ -0,0 +1,35 @@
+import time
+
+
+class StartupProfile:
+    """
+    Records the duration of consecutive startup phases: every `lap` closes the phase started by the previous one.
+    """
+    def __init__(self, title: str):
+        self.title = title
+        self.start = self.last = time.perf_counter()
+        self.phases = []
+
+    def lap(self, name: str):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def record(self, name: str, seconds: float):
+        """
+        Records a phase timed elsewhere, e.g. one running concurrently with others.
+        """
+        self.phases.append((name, seconds))
+
+    def report(self):
+        from utils.metrics import metrics
+
+        total = time.perf_counter() - self.start
+        for name, seconds in self.phases:
+            metrics.observe("startup_phase_seconds", seconds, profile=self.title.lower(), phase=name)
+        metrics.event(f"{self.title.lower()}_profile", **{name: round(t, 2) for name, t in self.phases},
+                      total=round(total, 2))
+
+
+# Started on first import, app.py imports this module before anything heavy
+profile = StartupProfile("STARTUP")
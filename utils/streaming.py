@@ -0,0 +1,58 @@
+from langchain_core.callbacks import BaseCallbackHandler
+
+from typing import Any, Callable, Optional
+
+
+# Metadata flag of the LLM calls whose tokens are forwarded to the chat
+STREAM_ANSWER = "stream_answer"
+
+# Nodes running nested agents for intermediate results, e.g. the research answers of the essay writer
+INTERMEDIATE_NODES = {"research_plan"}
+
+NODE_EVENTS = {
+    "grader": "grading",
+    "hallucinations": "checking hallucinations",
+    "planner": "planning essay",
+    "research_plan": "researching",
+    "generate": "generating answer",
+}
+
+TOOL_EVENTS = {
+    "retrieve_research_papers": "retrieving",
+    "web_search_tool": "web search",
+    "research_assistant": "research assistant",
+    "essay_writer": "essay writer",
+    "chat": "chat",
+}
+
+
+def is_answer_chunk(namespace: tuple, metadata: dict) -> bool:
+    """
+    Whether a streamed message chunk belongs to a final answer: flagged with `STREAM_ANSWER`
+    and not generated inside one of the `INTERMEDIATE_NODES`.
+    """
+    if not metadata.get(STREAM_ANSWER):
+        return False
+    path = list(namespace) + metadata.get("langgraph_checkpoint_ns", "").split("|")
+    return not any(part.split(":")[0] in INTERMEDIATE_NODES for part in path)
+
+
+class ProgressCallbackHandler(BaseCallbackHandler):
+    """
+    Emits ("progress", label) events when graph nodes or tools of interest start.
+    Passed as a callback to the main graph, it is inherited by subgraphs invoked from tools.
+    `emit` may be called from worker threads.
+    """
+    def __init__(self, emit: Callable[[tuple], None]):
+        self.emit = emit
+
+    def on_chain_start(self, serialized: Optional[dict], inputs: Any, *, metadata: Optional[dict] = None,
+                       **kwargs: Any):
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and kwargs.get("name") == node and node in NODE_EVENTS:
+            self.emit(("progress", NODE_EVENTS[node]))
+
+    def on_tool_start(self, serialized: Optional[dict], input_str: str, **kwargs: Any):
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        if name in TOOL_EVENTS:
+            self.emit(("progress", TOOL_EVENTS[name]))
@@ -1,50 +1,223 @@
 import gradio as gr
+import asyncio
+import os
+import threading
+import time
 from langchain.tools.retriever import create_retriever_tool
 from langchain_core.tools import Tool
+from collections import OrderedDict
+from typing import Optional
 
 from utils.prompts import RETRIEVER_TOOL_PROMPT
 from retriever import web_search_tool, DocumentProcessor, IndexBuilder
 from utils import config, llm, memory
+from utils.manifest import file_hash, upload_key
+from utils.semantic_cache import SemanticCache, SemanticCacheRetriever
+from utils.streaming import ProgressCallbackHandler, is_answer_chunk
+from utils.runtime import HandleRetriever, RetrieverHandle, runtime_option, runtime_options
+from utils.reranker import load_cross_encoder
+from utils.startup import StartupProfile, profile
+from utils.metrics import metrics, metrics_callback
+from utils.jobs import IngestJob, JobQueue
+from utils.llm_cache import uncached
 from agents.main_graph import Supervisor
 
 
 class GradioHandler:
     def __init__(self):
 
-        self.builder, self.retriever_tool = self.build_retriever()
+        self.query_cache = None
+        if config.semantic_cache:
+            self.query_cache = SemanticCache(config.semantic_cache_threshold,
+                                             config.semantic_cache_size,
+                                             config.semantic_cache_ttl)
+        self.builder = IndexBuilder()
+        if self.query_cache is not None:
+            self.builder.add_change_listener(self.query_cache.invalidate)
+        self.index_ready = threading.Event()
+        self.retriever_handle = RetrieverHandle()
+        self.ingest_jobs = JobQueue(self.run_ingest_job, config.ingest_job_workers,
+                                    on_done=lambda job: self.refresh_retriever())
+        self.retriever_tool = self.make_retriever_tool(self.builder, self.retriever_handle, self.query_cache)
         self.tools = [self.retriever_tool, web_search_tool]
         self.config = {"configurable": {"thread_id": "1"}}
+        profile.lap("index builder")
+
         self.maingraph = Supervisor(llm, self.tools, memory, self.config)
         self.agent = self.maingraph.graph
+        self.last_ttft = None
+        self.run_slots = asyncio.Semaphore(config.max_concurrent_runs)
+        self.session_options = OrderedDict()
+        self.max_sessions = 1024
+        profile.lap("compile graphs")
 
-    @staticmethod
-    def build_retriever() -> tuple[IndexBuilder, Tool]:
+        if not config.fast_start:
+            self.warmup_index()
+            profile.lap("index warmup")
+
+    def warmup_index(self):
+        """
+        Opens the vectorstore, synchronizes it with the documents directory and swaps in the retriever.
+        """
+        try:
+            self.builder.build_vectorstore()
+            self.builder.sync_documents(DocumentProcessor.list_documents())
+            self.retriever_handle.swap(self.builder.build_retriever())
+        except Exception as e:
+            self.retriever_handle.fail(e)
+            raise
+        finally:
+            self.index_ready.set()
+
+    async def prewarm_models(self):
+        """
+        Loads the Ollama chat and embedding models into memory with minimal requests.
+        Both bypass the response and embedding caches, a cached answer would not load the model.
+        """
+        await asyncio.gather(uncached(llm).model_copy(update={"num_predict": 1}).ainvoke("Hi"),
+                             self.builder.embeddings.embeddings.aembed_query("warmup"))
 
-        builder = IndexBuilder()
-        builder.build_vectorstore()
-        if len(builder.vectorstore.get()["ids"]) == 0:
-            docs_list = DocumentProcessor.load_documents()
-            builder.pull_documents(docs_list)
+    def start_warmup(self):
+        """
+        Warms up the index, the cross-encoder and the Ollama models in a background thread,
+        called once the UI is serving. Requests needing the retriever wait for it.
+        """
+        async def warmup():
+            warmup_profile = StartupProfile("WARMUP")
 
-        retriever = builder.build_retriever()
-        retriever_tool = create_retriever_tool(
+            async def timed(name: str, awaitable):
+                start = time.perf_counter()
+                try:
+                    await awaitable
+                except Exception as e:
+                    metrics.inc("warmup_errors_total", phase=name)
+                    metrics.event("warmup_failed", phase=name, error=repr(e))
+                warmup_profile.record(name, time.perf_counter() - start)
+
+            phases = [timed("index", asyncio.to_thread(self.warmup_index)),
+                      timed("ollama models", self.prewarm_models())]
+            if config.reranking:
+                phases.append(timed("cross-encoder", asyncio.to_thread(load_cross_encoder, config.rerank_model,
+                                                                       config.rerank_max_length,
+                                                                       config.rerank_threads)))
+            await asyncio.gather(*phases)
+            warmup_profile.report()
+
+        threading.Thread(target=asyncio.run, args=(warmup(),), name="warmup", daemon=True).start()
+
+    @staticmethod
+    def make_retriever_tool(builder: IndexBuilder, handle: RetrieverHandle,
+                            query_cache: Optional[SemanticCache] = None) -> Tool:
+        """
+        Wraps the retriever handle into the retriever tool, behind the semantic query cache if one is given.
+        Cached results are only reused for the same `top_k` and reranking options of the run.
+        """
+        retriever = HandleRetriever(handle=handle)
+        if query_cache is not None:
+            retriever = SemanticCacheRetriever(retriever=retriever,
+                                               cache=query_cache,
+                                               embeddings=builder.embeddings,
+                                               settings=lambda: (runtime_option("top_k"), runtime_option("reranking")))
+        return create_retriever_tool(
             retriever,
             "retrieve_research_papers",
             RETRIEVER_TOOL_PROMPT,
             response_format="content_and_artifact"
         )
-        return builder, retriever_tool
 
+    def refresh_retriever(self):
+        """
+        Rebuilds the retriever over the current index and swaps it in. Compiled graphs are kept.
+        """
+        self.retriever_handle.swap(self.builder.build_retriever())
+        if self.query_cache is not None:
+            self.query_cache.invalidate()
+
+    def session_config(self, request: Optional[gr.Request]) -> dict:
+        """
+        Graph config with a conversation thread and the runtime options per browser session.
+        """
+        if request is None or not request.session_hash:
+            return self.config
+        options = self.session_options.get(request.session_hash, {})
+        return {"configurable": {"thread_id": request.session_hash, **options}}
 
-    def respond(self, chatbot: list, user_input, input_audio_block=None):
+    async def respond(self, chatbot: list, user_input, input_audio_block=None, request: gr.Request = None):
+        """
+        Streams the answer into the chatbot. The graph runs as a separate task, at most
+        `config.max_concurrent_runs` at once; final answer tokens and progress events of nodes
+        and tools are passed through a queue.
+        """
         message = user_input['text']
-        response = self.agent.invoke({"messages": [message]}, self.config)
-        chatbot.append((message, response['messages'][-1].content))
-        yield chatbot, gr.MultimodalTextbox(value=None, interactive=False, file_types=["image"]), ""
+        textbox = gr.MultimodalTextbox(value=None, interactive=False, file_types=["image"])
+        config = self.session_config(request)
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def emit(event: tuple):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        async def run_graph():
+            try:
+                async with self.run_slots:
+                    run_config = {**config, "callbacks": [ProgressCallbackHandler(emit), metrics_callback]}
+                    async for namespace, (chunk, metadata) in self.agent.astream({"messages": [message]}, run_config,
+                                                                                 stream_mode="messages", subgraphs=True):
+                        if chunk.content and is_answer_chunk(namespace, metadata):
+                            events.put_nowait(("token", chunk))
+            except Exception as e:
+                events.put_nowait(("error", e))
+            finally:
+                events.put_nowait(("done", None))
+
+        start = time.perf_counter()
+        task = asyncio.create_task(run_graph())
+        chatbot.append((message, ""))
+        progress, answer, answer_id, ttft = [], "", None, None
+        try:
+            while True:
+                kind, payload = await events.get()
+                if kind == "done":
+                    break
+                if kind == "error":
+                    raise RuntimeError(f"Error running agent: {payload}")
+                if kind == "progress":
+                    progress.append(payload)
+                elif kind == "token":
+                    if ttft is None:
+                        ttft = self.last_ttft = time.perf_counter() - start
+                        metrics.observe("time_to_first_token_seconds", ttft)
+                    # A new generation (e.g. after a web search fallback) replaces the previous one
+                    if payload.id != answer_id:
+                        answer_id, answer = payload.id, ""
+                    answer += payload.content
+                    chatbot[-1] = (message, answer)
+                yield chatbot, textbox, self.format_progress(progress)
+        finally:
+            if not task.done():
+                task.cancel()
+
+        state = await self.agent.aget_state(config)
+        chatbot[-1] = (message, state.values["messages"][-1].content)
+        metrics.observe("response_seconds", time.perf_counter() - start)
+        metrics.event("response", ttft_s=round(ttft, 2) if ttft is not None else None,
+                      seconds=round(time.perf_counter() - start, 2))
+        yield chatbot, textbox, self.format_progress(progress)
+
+    @staticmethod
+    def format_progress(progress: list[str]) -> str:
+        return "\n".join(["**Progress**"] + [f"- {step}" for step in progress])
+
+    def run_ingest_job(self, job: IngestJob):
+        """
+        Ingests the files of an upload job once the index is warmed up, reporting progress to the job.
+        """
+        self.index_ready.wait()
+        self.builder.ingest_documents(job.paths, job.keys, progress=job.update)
 
     def process_uploaded_files(self, files_dir: list, chatbot: list) -> tuple:
         """
-        Process uploaded files to prepare a VectorDB.
+        Queues uploaded files for background ingestion. The retriever is refreshed when the job is done.
 
         Parameters:
             files_dir (List): List of paths to the uploaded files.
@@ -53,42 +226,44 @@ class GradioHandler:
         Returns:
             Tuple: A tuple containing an empty string and the updated chatbot instance.
         """
-        docs = []
+        paths, keys, skipped = [], [], []
         for f in files_dir:
-            docs.extend(DocumentProcessor.load_pdf(f))
-        self.builder.pull_documents(docs)
-        chatbot.append(
-            (None, "Uploaded files are ready. Please ask your question"))
+            hash_ = file_hash(f)
+            if self.builder.manifest.find_hash(hash_) is not None:
+                skipped.append(os.path.basename(f))
+                continue
+            paths.append(f)
+            keys.append(upload_key(f, hash_))
+        if skipped:
+            chatbot.append(
+                (None, f"Already indexed, skipped: {', '.join(skipped)}"))
+        if paths:
+            job = self.ingest_jobs.submit(paths, keys)
+            chatbot.append(
+                (None, f"Indexing {len(paths)} file(s) in the background (job {job.id}). "
+                       "They are searched as soon as the job is done, you can keep asking questions meanwhile"))
         return chatbot, gr.MultimodalTextbox(value=None, interactive=False, file_types=["image"])
 
-    def process_selected_options(self, options: list, top_k: int, chatbot: list) -> tuple:
-
-        #Change config arguments
-        config.top_k = top_k
-        if "reranking" in options:
-            config.reranking = True
-        else:
-            config.reranking = False
+    def jobs_status(self) -> str:
+        """
+        Progress of running and recently finished ingestion jobs, polled by the UI.
+        """
+        return "\n".join(f"- {job.summary()}" for job in self.ingest_jobs.recent())
 
-        if "check hallucinations" in options:
-            config.hallucinations = True
+    def process_selected_options(self, options: list, top_k: int, chatbot: list, request: gr.Request = None) -> tuple:
+        """
+        Stores the RAG options of the session, they are passed to the graphs with every request.
+        """
+        session_options = runtime_options(top_k=top_k,
+                                          reranking="reranking" in options,
+                                          hallucinations="check hallucinations" in options)
+        if request is None or not request.session_hash:
+            self.config = {"configurable": {**self.config["configurable"], **session_options}}
         else:
-            config.hallucinations = False
-
-        #rebuild retriever and refresh graph
-        try:
-            retriever = self.builder.build_retriever()
-
-            self.retriever_tool = create_retriever_tool(
-                retriever,
-                "retrieve_research_papers",
-                RETRIEVER_TOOL_PROMPT,
-                response_format = "content_and_artifact"
-            )
-            self.tools=[self.retriever_tool, web_search_tool]
-        except Exception as e:
-            raise RuntimeError(f"Error refreshing rag: {e}")
-        self.maingraph.refresh(llm, self.tools, memory, self.config)
+            self.session_options[request.session_hash] = session_options
+            self.session_options.move_to_end(request.session_hash)
+            while len(self.session_options) > self.max_sessions:
+                self.session_options.popitem(last=False)
 
         chatbot.append(
             (None, "RAG refreshed. Please ask your question"))
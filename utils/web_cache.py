@@ -0,0 +1,99 @@
+from typing import Optional
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    query TEXT PRIMARY KEY,
+    urls TEXT NOT NULL,
+    created REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    created REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queries_created ON queries (created);
+CREATE INDEX IF NOT EXISTS pages_created ON pages (created);
+"""
+
+
+class WebCache:
+    """
+    Persistent two-layer cache of the web search path: query -> result urls and url -> extracted paragraphs.
+
+    Entries older than `ttl` seconds are ignored and purged, the oldest entries are evicted when
+    the stored payload exceeds `max_bytes`. In offline mode expired entries are still served.
+    """
+    def __init__(self, path: str, ttl: float, max_bytes: int, offline: bool = False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+    def _get(self, table: str, key_column: str, value_column: str, key: str) -> Optional[list[str]]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {value_column}, created FROM {table} WHERE {key_column} = ?",
+                                     (key,)).fetchone()
+            if row is None or (not self.offline and time.time() - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def _put(self, table: str, key_column: str, value_column: str, key: str, value: list[str]):
+        payload = json.dumps(value)
+        with self._lock, self._conn:
+            self._conn.execute(f"INSERT OR REPLACE INTO {table} ({key_column}, {value_column}, created, size) "
+                               f"VALUES (?, ?, ?, ?)", (key, payload, time.time(), len(payload)))
+            self._evict()
+
+    def _evict(self):
+        """
+        Drops expired entries, then the oldest ones until the payload fits into `max_bytes`.
+        """
+        cutoff = time.time() - self.ttl
+        self._conn.execute("DELETE FROM queries WHERE created < ?", (cutoff,))
+        self._conn.execute("DELETE FROM pages WHERE created < ?", (cutoff,))
+        total = self._conn.execute("SELECT (SELECT COALESCE(SUM(size), 0) FROM queries) + "
+                                   "(SELECT COALESCE(SUM(size), 0) FROM pages)").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._conn.execute("SELECT 'pages', url, created, size FROM pages UNION ALL "
+                                     "SELECT 'queries', query, created, size FROM queries "
+                                     "ORDER BY created LIMIT 1").fetchone()
+            if row is None:
+                break
+            table, key, _, size = row
+            key_column = "url" if table == "pages" else "query"
+            self._conn.execute(f"DELETE FROM {table} WHERE {key_column} = ?", (key,))
+            total -= size
+
+    def get_urls(self, query: str) -> Optional[list[str]]:
+        return self._get("queries", "query", "urls", query)
+
+    def put_urls(self, query: str, urls: list[str]):
+        self._put("queries", "query", "urls", query, urls)
+
+    def get_page(self, url: str) -> Optional[list[str]]:
+        return self._get("pages", "url", "content", url)
+
+    def put_page(self, url: str, content: list[str]):
+        self._put("pages", "url", "content", url, content)
+
+    def stats(self) -> dict:
+        with self._lock:
+            queries, pages = (self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                              for table in ("queries", "pages"))
+        return {"hits": self.hits, "misses": self.misses, "queries": queries, "pages": pages}
@@ -1,9 +1,15 @@
 from duckduckgo_search import DDGS
 from typing import Optional
 
+from utils import config
+from utils.metrics import metrics
+from utils.web_cache import WebCache
+
+web_cache = WebCache(config.web_cache_path, config.web_cache_ttl, config.web_cache_max_bytes, config.web_offline)
+
 def web_search_text(query: str, max_results: Optional[int] = 10) -> list[str]:
     """
-    Search for text on duckduckgo.com.
+    Search for text on duckduckgo.com. Results are cached, in offline mode only the cache is used.
 
     Args:
         query (str): The text to search for.
@@ -12,7 +18,18 @@ def web_search_text(query: str, max_results: Optional[int] = 10) -> list[str]:
     Returns:
         List of search results as strings.
     """
-    print("---USING WEB SEARCH---")
-    with DDGS() as ddgs:
-        results = results = [r['href'] for r in ddgs.text(query, max_results=max_results)]
-    return results
\ No newline at end of file
+    key = f"{max_results}:{query}"
+    cached = web_cache.get_urls(key)
+    if cached is not None:
+        metrics.inc("web_search_cache_hits_total")
+        metrics.event("web_search_cache_hit")
+        return cached
+    if web_cache.offline:
+        metrics.event("web_search_offline_miss")
+        return []
+
+    metrics.inc("web_search_cache_misses_total")
+    with metrics.timed("web_search"), DDGS() as ddgs:
+        results = [r['href'] for r in ddgs.text(query, max_results=max_results)]
+    web_cache.put_urls(key, results)
+    return results